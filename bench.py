@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+
+# midi2xml benchmarks - times the converters on synthetic midi workloads and
+# compares the results with stored baselines
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pretty_midi
+
+from ezchord import chord_progression_to_xml, transition, voicings
+from main import create_note, get_note_type, read_from_xml, write_to_xml
+from smf import read_midi
+
+BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json"
+)
+
+# a benchmark regresses when it is this many times slower, or uses this many times more memory, than its baseline
+DEFAULT_THRESHOLD = 1.25
+# seconds a benchmark must also slow down by to regress, as smaller differences are mostly noise
+MIN_SECONDS = 0.005
+
+# note lengths, in beats, the workloads draw from
+NOTE_LENGTHS = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0)
+
+
+def new_song(seed):
+    song = pretty_midi.PrettyMIDI(initial_tempo=120)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    song.key_signature_changes.append(pretty_midi.KeySignature(0, 0))
+    return song, random.Random(seed)
+
+
+def add_part(song, rng, seconds, density, name, low=36, high=96, lengths=NOTE_LENGTHS):
+    """adds a part of random notes, about density notes per second"""
+    part = pretty_midi.Instrument(program=0, name=name)
+    for _ in range(int(seconds * density)):
+        start = round(rng.uniform(0, seconds) * 8) / 8
+        length = rng.choice(lengths) / 2
+        part.notes.append(
+            pretty_midi.Note(90, rng.randint(low, high), start, start + length)
+        )
+    part.notes.sort(key=lambda note: note.start)
+    song.instruments.append(part)
+
+
+def dense_piano(scale=1.0):
+    """two minutes of one piano playing about 16 notes per second"""
+    song, rng = new_song(1)
+    add_part(song, rng, 120 * scale, 16, "Piano")
+    return song
+
+
+def many_tracks(scale=1.0):
+    """a minute of 24 parts at 2 notes per second"""
+    song, rng = new_song(2)
+    for n in range(max(1, int(24 * scale))):
+        add_part(song, rng, 60, 2, f"Part {n + 1}")
+    return song
+
+
+def long_duration(scale=1.0):
+    """twenty minutes of a sparse piano"""
+    song, rng = new_song(3)
+    add_part(song, rng, 1200 * scale, 2, "Piano")
+    return song
+
+
+def signature_changes(scale=1.0):
+    """two minutes with the time and key signature changing every few measures"""
+    song, rng = new_song(4)
+    seconds = 120 * scale
+    song.time_signature_changes.clear()
+    song.key_signature_changes.clear()
+    time_ = 0.0
+    while time_ < seconds:
+        numerator, denominator = rng.choice([(2, 4), (3, 4), (4, 4), (5, 4), (6, 8)])
+        song.time_signature_changes.append(
+            pretty_midi.TimeSignature(numerator, denominator, time_)
+        )
+        song.key_signature_changes.append(
+            pretty_midi.KeySignature(rng.randint(0, 23), time_)
+        )
+        # two or three measures of the new signature at 120 bpm
+        time_ += rng.randint(2, 3) * numerator * (4 / denominator) / 2
+    add_part(song, rng, seconds, 6, "Piano")
+    return song
+
+
+def tied_overlapping(scale=1.0):
+    """two minutes of long, overlapping notes tied across barlines"""
+    song, rng = new_song(5)
+    add_part(song, rng, 120 * scale, 6, "Strings", lengths=(5.0, 7.0, 9.5, 13.0))
+    return song
+
+
+# synthetic songs, by name
+WORKLOADS = {
+    "dense_piano": dense_piano,
+    "many_tracks": many_tracks,
+    "long_duration": long_duration,
+    "signature_changes": signature_changes,
+    "tied_overlapping": tied_overlapping,
+}
+
+# a short progression in the style of bminor-chordprog-example.txt
+CHORD_PROGRESSION = ["Bm", "G", "D", "A", "Bm", "Em7", "F#7", "Bm"] * 8
+
+
+def writing(workload, scale, directory):
+    def setup():
+        song = WORKLOADS[workload](scale)
+        path = os.path.join(directory, f"write_{workload}.xml")
+        return lambda: write_to_xml(song, path)
+
+    return setup
+
+
+def reading(workload, scale, directory):
+    def setup():
+        path = os.path.join(directory, f"read_{workload}.xml")
+        write_to_xml(WORKLOADS[workload](scale), path)
+        return lambda: read_from_xml(path)
+
+    return setup
+
+
+def midi_reading(workload, scale):
+    def setup():
+        midi = io.BytesIO()
+        WORKLOADS[workload](scale).write(midi)
+        data = midi.getvalue()
+
+        def run():
+            # a single read takes a few milliseconds
+            for _ in range(10):
+                read_midi(data)
+
+        return run
+
+    return setup
+
+
+def note_types(scale):
+    def setup():
+        durations = range(1, 800)
+        repeats = max(1, int(100 * scale))
+
+        def run():
+            for _ in range(repeats):
+                for duration in durations:
+                    get_note_type(duration)
+
+        return run
+
+    return setup
+
+
+def notes(scale):
+    def setup():
+        durations = range(1, 400)
+        repeats = max(1, int(25 * scale))
+
+        def run():
+            for _ in range(repeats):
+                for duration in durations:
+                    create_note("C#4", duration, None, False, False, 2)
+
+        return run
+
+    return setup
+
+
+def chord_progressions(scale):
+    def setup():
+        progression = CHORD_PROGRESSION * max(1, int(scale))
+
+        # a batch of progressions, one alone renders in a fraction of a millisecond
+        def run():
+            for _ in range(500):
+                chord_progression_to_xml(progression)
+
+        return run
+
+    return setup
+
+
+def voice_leading(scale):
+    def setup():
+        # every chord quality on every root, in an order that repeats few chord pairs
+        names = [
+            root + quality
+            for quality in ("", "m", "7", "maj7", "m7", "m7b5", "9", "13", "6/9")
+            for root in (
+                "C",
+                "Db",
+                "D",
+                "Eb",
+                "E",
+                "F",
+                "F#",
+                "G",
+                "Ab",
+                "A",
+                "Bb",
+                "B",
+            )
+        ]
+        progression = [names[i * 7 % len(names)] for i in range(int(1000 * scale))]
+
+        def run():
+            # voiced from scratch, without the voicings of the run before
+            voicings.cache_clear()
+            transition.cache_clear()
+            chord_progression_to_xml(progression, voice_leading=True)
+
+        return run
+
+    return setup
+
+
+def benchmarks(scale, directory):
+    """returns a dict of benchmark name to setup, which returns the callable timed (None if unavailable)
+
+    Files the benchmarks write go in directory.
+    """
+    result = {}
+    for workload in WORKLOADS:
+        result[f"write_to_xml/{workload}"] = writing(workload, scale, directory)
+    for workload in WORKLOADS:
+        result[f"read_from_xml/{workload}"] = reading(workload, scale, directory)
+    for workload in WORKLOADS:
+        result[f"read_midi/{workload}"] = midi_reading(workload, scale)
+    result["get_note_type"] = note_types(scale)
+    result["create_note"] = notes(scale)
+    result["chord_progression_to_xml"] = chord_progressions(scale)
+    result["chord_progression_to_xml/voice_leading"] = voice_leading(scale)
+    return result
+
+
+def measure(run, repeats=3):
+    """Times a callable and measures the memory it allocates.
+
+    Args:
+    run : callable
+        the code benchmarked
+    repeats : int
+        number of timed runs, the fastest is kept
+
+    Returns:
+        a dict of the fastest run's wall time in seconds and the peak traced
+        allocation of one more run, in bytes
+    """
+    seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - started)
+    # tracing slows allocation down, so memory is measured on a run of its own
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_bytes": peak}
+
+
+def run_benchmarks(names=None, scale=1.0, repeats=3, progress=None):
+    """Runs benchmarks, returning a dict of name to result (see measure), or None for unavailable ones."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, setup in benchmarks(scale, directory).items():
+            if names and not any(name.startswith(prefix) for prefix in names):
+                continue
+            run = setup()
+            results[name] = measure(run, repeats) if run is not None else None
+            if progress:
+                progress(name, results[name])
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compares results with a baseline.
+
+    Args:
+    results, baseline : dict
+        benchmark results by name, see run_benchmarks
+    threshold : float
+        ratio to its baseline a result may reach before it is a regression;
+        a time must also be at least MIN_SECONDS slower
+
+    Returns:
+        a list of (name, metric, ratio) of each regression
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not result or not base:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if base[metric] > 0 and result[metric] / base[metric] > threshold:
+                if metric == "seconds" and result[metric] - base[metric] < MIN_SECONDS:
+                    continue
+                regressions.append((name, metric, result[metric] / base[metric]))
+    return regressions
+
+
+def print_result(name, result):
+    if result is None:
+        print(f"{name:40} unavailable")
+    else:
+        print(
+            f"{name:40} {result['seconds'] * 1000:10.2f} ms {result['peak_bytes'] / 1024**2:10.2f} MB"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="midi2xml benchmarks - time the converters on synthetic workloads"
+    )
+    parser.add_argument(
+        "names", type=str, nargs="*", help="Run only benchmarks starting with these"
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="Workload size multiplier (default 1)"
+    )
+    parser.add_argument(
+        "-r",
+        "--repeats",
+        type=int,
+        default=3,
+        help="Timed runs per benchmark (default 3)",
+    )
+    parser.add_argument(
+        "-b", "--baseline", type=str, default=BASELINE, help="Baseline file"
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Store the results as the new baseline"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Exit with status 1 if a benchmark regressed against the baseline",
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"Ratio to the baseline counted as a regression (default {DEFAULT_THRESHOLD})",
+    )
+    parser.add_argument("--json", type=str, help="Also write the results to this file")
+
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names, args.scale, args.repeats, print_result)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"scale": args.scale, "benchmarks": results}, file, indent=2)
+    baseline = {"scale": args.scale, "benchmarks": {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    if baseline["scale"] != args.scale:
+        parser.error(f"the baseline was run at --scale {baseline['scale']}")
+    if args.save:
+        baseline["benchmarks"].update(
+            {name: result for name, result in results.items() if result}
+        )
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+            file.write("\n")
+    if args.check:
+        regressions = compare(results, baseline["benchmarks"], args.threshold)
+        for name, metric, ratio in regressions:
+            print(
+                f"regression: {name} {metric} is {ratio:.2f}x its baseline",
+                file=sys.stderr,
+            )
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
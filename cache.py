@@ -0,0 +1,169 @@
+# conversion cache - stores conversion results on disk, keyed by a hash of the
+# input bytes, the conversion options and the converter's source
+
+import hashlib
+import json
+import os
+import tempfile
+
+import ezchord
+import main
+import smf
+
+# prefix of files being written, which are not entries until they are renamed
+TEMP_PREFIX = ".tmp-"
+
+
+def converter_version():
+    """returns a hash of the converters' source, so results of an older converter are never reused"""
+    digest = hashlib.sha256()
+    for module in (main, ezchord, smf):
+        with open(module.__file__, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+
+CONVERTER_VERSION = converter_version()
+
+
+class ConversionCache:
+    """An on-disk cache of conversion results with least recently used eviction.
+
+    Entries are files named after their key. They are written to a temporary
+    file and renamed into place, so processes sharing a directory never read
+    a partial entry, and reading an entry updates its modification time,
+    which eviction uses as its last use. Each instance estimates the
+    directory's size from one scan plus its own writes, and rescans and
+    evicts once the estimate passes max_bytes; with several writers the
+    directory can briefly hold more than max_bytes.
+
+    Args:
+    directory : str
+        directory holding the entries, created if missing
+    max_bytes : int
+        size the entries are evicted down to
+    """
+
+    def __init__(self, directory, max_bytes=1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, _, size in self.entries())
+
+    def key(self, data, options=None):
+        """Returns the key of a conversion.
+
+        Args:
+        data : bytes
+            input of the conversion
+        options : dict
+            json serializable options the result depends on
+
+        Returns:
+            a hex digest of the data, options and converter version
+        """
+        digest = hashlib.sha256(CONVERTER_VERSION.encode("ascii"))
+        digest.update(json.dumps(options or {}, sort_keys=True).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(data)
+        return digest.hexdigest()
+
+    def path(self, key):
+        # entries are spread over 256 subdirectories to keep directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """returns the bytes stored under key, or None if there are none"""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as file:
+                value = file.read()
+            os.utime(path)
+        except OSError:
+            # missing, or evicted by another process since it was opened
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """stores value under key, evicting the least recently used entries if the cache is full"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, partial = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix=TEMP_PREFIX
+        )
+        try:
+            with os.fdopen(handle, "wb") as file:
+                file.write(value)
+            os.replace(partial, path)
+        except BaseException:
+            os.remove(partial)
+            raise
+        self.writes += 1
+        self.size += len(value)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def convert(self, data, options, convert):
+        """Returns the result of convert(data, options), from the cache if it holds one.
+
+        Args:
+        data : bytes
+            input of the conversion
+        options : dict
+            json serializable options passed to convert
+        convert : callable
+            called with (data, options) on a miss, returning bytes
+
+        Returns:
+            the converted bytes
+        """
+        key = self.key(data, options)
+        value = self.get(key)
+        if value is None:
+            value = convert(data, options)
+            self.put(key, value)
+        return value
+
+    def entries(self):
+        """yields (modification time, path, size) of each entry"""
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.startswith(TEMP_PREFIX):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, path, stat.st_size
+
+    def evict(self):
+        """removes least recently used entries until the cache holds at most max_bytes"""
+        entries = sorted(self.entries())
+        self.size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already evicted by another process
+                pass
+            else:
+                self.evictions += 1
+            self.size -= size
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "bytes": self.size,
+        }
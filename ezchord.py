@@ -0,0 +1,571 @@
+# ezchord - convert complex chord names to midi notes, and chord progressions to musicxml
+
+import math
+import xml.etree.ElementTree as ET
+from enum import Enum, auto
+from functools import lru_cache
+
+import numpy as np
+import pretty_midi
+
+from main import DEFAULT_VELOCITY, create_chord, create_rest, write_measure_attributes
+
+
+################################################################################
+# ENUMS AND CONSTANTS                                                          #
+################################################################################
+class Mode(Enum):
+    DIM = auto()
+    MIN = auto()
+    MAJ = auto()
+    DOM = auto()
+    AUG = auto()
+    SUS2 = auto()
+    SUS = auto()
+    FIVE = auto()
+
+
+TEXT_TO_MODE = {
+    "maj": Mode.MAJ,
+    "dim": Mode.DIM,
+    "o": Mode.DIM,
+    "min": Mode.MIN,
+    "m": Mode.MIN,
+    "-": Mode.MIN,
+    "aug": Mode.AUG,
+    "+": Mode.AUG,
+    "sus2": Mode.SUS2,
+    "sus": Mode.SUS,
+    "5": Mode.FIVE,
+    "five": Mode.FIVE,
+}
+
+MODE_TO_SHIFT = {
+    Mode.MAJ: {3: 0, 5: 0},
+    Mode.DOM: {3: 0, 5: 0},
+    Mode.DIM: {3: -1, 5: -1},
+    Mode.MIN: {3: -1, 5: 0},
+    Mode.AUG: {3: 0, 5: 1},
+    Mode.SUS2: {3: -2, 5: 0},
+    Mode.SUS: {3: 1, 5: 0},
+    Mode.FIVE: {3: 3, 5: 0},
+}
+
+NOTE_TO_PITCH = {"a": 9, "b": 11, "c": 12, "d": 14, "e": 16, "f": 17, "g": 19}
+
+PITCH_TO_NOTE = {pitch: note for note, pitch in NOTE_TO_PITCH.items()}
+
+RM_TO_PITCH = {"vii": 11, "iii": 4, "vi": 9, "iv": 5, "ii": 2, "i": 0, "v": 7}
+
+ACC_TO_SHIFT = {"b": -1, "#": 1}
+
+SCALE_DEGREE_SHIFT = {1: 0, 2: 2, 3: 4, 4: 5, 5: 7, 6: 9, 7: 11}
+
+# chord names that insert a rest
+NO_CHORD = ("nc", "n.c", "n.c.")
+
+# chords parsed and chord fragments rendered, kept by the lru tables below
+CACHE_SIZE = 4096
+
+# semitones of movement a voicing costs per semitone its bass, and its other notes
+# on average, are away from the first chord's, which keeps a voiced progression
+# from drifting
+DRIFT_COST = 0.25
+
+
+################################################################################
+# HELPER FUNCTIONS                                                             #
+################################################################################
+def get_number(text):
+    """returns the number made of the digits in text, None if there are none"""
+    num_str = "".join(char for char in text if char.isdigit())
+    return int(num_str) if num_str else None
+
+
+def text_to_pitch(text, key="c"):
+    """returns the pitch class (C is 12) of a note name or a roman numeral in key"""
+    text = text.lower()
+    is_letter = text[0] in NOTE_TO_PITCH
+    if is_letter:
+        pitch = NOTE_TO_PITCH[text[0]]
+    else:
+        for rm in RM_TO_PITCH:
+            if rm in text:
+                pitch = RM_TO_PITCH[rm] + text_to_pitch(key)
+                break
+        else:
+            raise ValueError(f"{text!r} is not a note name or roman numeral")
+
+    for char in text[1 if is_letter else 0 :]:
+        pitch += ACC_TO_SHIFT.get(char, 0)
+
+    return pitch
+
+
+def pitch_to_text(pitch):
+    """returns the name of a midi pitch, with flats for accidentals ('Bb3')"""
+    octave = math.floor(pitch / 12)
+    pitch = pitch % 12
+    pitch = pitch + (12 if pitch < 9 else 0)
+    accidental = ""
+
+    if pitch not in PITCH_TO_NOTE:
+        pitch = (pitch + 1) % 12
+        pitch = pitch + (12 if pitch < 9 else 0)
+        accidental = "b"
+
+    return PITCH_TO_NOTE[pitch].upper() + accidental + str(octave)
+
+
+def degree_to_shift(deg):
+    """returns the semitones a scale degree (9, 11, 13 included) is above the root"""
+    return SCALE_DEGREE_SHIFT[(deg - 1) % 7 + 1] + math.floor(deg / 8) * 12
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def voicings(pitches):
+    """Returns the voicings a chord may be moved to, memoized per chord.
+
+    The notes above the bass are inverted and moved by up to an octave
+    either way, and the bass by up to an octave, staying below them.
+
+    Args:
+    pitches : tuple
+        midi pitches of the chord, the bass note first
+
+    Returns:
+        a tuple (voiced, upper, upperIndexes) of arrays: the midi pitches of
+        each voicing, the bass first and the notes above it in ascending
+        order (the chord as it was given is the first); the distinct
+        arrangements of the notes above the bass; and the arrangement of
+        each voicing
+    """
+    bass = pitches[0]
+    notes = sorted(set(pitches[1:]))
+    voiced = []
+    upper = []
+    upperIndexes = []
+    for shift in (0, -12, 12):
+        for inversion in range(max(len(notes), 1)):
+            arrangement = [
+                pitch + shift
+                for pitch in notes[inversion:]
+                + [pitch + 12 for pitch in notes[:inversion]]
+            ]
+            if arrangement and (arrangement[0] < 0 or arrangement[-1] > 127):
+                continue
+            basses = [
+                bass + bassShift
+                for bassShift in (0, -12, 12)
+                if 0 <= bass + bassShift
+                and (not arrangement or bass + bassShift < arrangement[0])
+            ]
+            if basses:
+                for pitch in basses:
+                    voiced.append([pitch] + arrangement)
+                    upperIndexes.append(len(upper))
+                upper.append(arrangement)
+    if not voiced:
+        voiced.append([bass] + notes)
+        upperIndexes.append(0)
+        upper.append(notes)
+    result = (np.array(voiced), np.array(upper), np.array(upperIndexes))
+    # shared by every progression using the chord
+    for array in result:
+        array.flags.writeable = False
+    return result
+
+
+def movement(previous, current):
+    """Returns how far the notes move between each pair of voicings of two chords.
+
+    The bass moves to the bass, and every other note to the nearest note of
+    the other chord, counted from both chords and halved. The notes above
+    the bass are compared once per arrangement, whatever the bass under them.
+
+    Args:
+    previous, current : tuple
+        voicings of the two chords, see voicings
+
+    Returns:
+        an array of semitones moved, one row per voicing of current and one
+        column per voicing of previous
+    """
+    previousVoiced, previousUpper, previousIndexes = previous
+    currentVoiced, currentUpper, currentIndexes = current
+    bass = np.abs(currentVoiced[:, None, 0] - previousVoiced[None, :, 0])
+    if currentUpper.shape[1] == 0 or previousUpper.shape[1] == 0:
+        return bass.astype(float)
+    gaps = np.abs(currentUpper[:, None, :, None] - previousUpper[None, :, None, :])
+    upper = (gaps.min(axis=3).sum(axis=2) + gaps.min(axis=2).sum(axis=2)) / 2
+    return bass + upper[np.ix_(currentIndexes, previousIndexes)]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def transition(previous, current):
+    """returns the movement between the voicings of two chords' midi pitches, see movement, memoized per pair of chords"""
+    result = movement(voicings(previous), voicings(current))
+    result.flags.writeable = False
+    return result
+
+
+def voice(chords):
+    """Moves each chord's notes by octaves and inversions so the progression moves least.
+
+    Every chord's voicings (see voicings) are searched at once by dynamic
+    programming: the cheapest way to reach each voicing of a chord is kept,
+    so the voicings chosen move the notes least over the whole progression,
+    with a small cost for drifting from the first chord's register (see
+    DRIFT_COST). Chord pairs' movements are memoized, see transition.
+
+    Args:
+    chords : list
+        lists of midi pitches, the bass note first
+
+    Returns:
+        a list of the voiced chords, each in ascending order
+    """
+    chords = [tuple(chord) for chord in chords]
+    candidates = [voicings(chord) for chord in chords]
+    # bass and mean pitch of the notes above it of the first chord as it was given
+    bassCenter = chords[0][0]
+    center = np.mean(chords[0][1:]) if len(chords[0]) > 1 else 0.0
+
+    def register(options):
+        voiced, upper, upperIndexes = options
+        drift = np.abs(voiced[:, 0] - bassCenter)
+        if upper.shape[1] != 0:
+            drift = drift + np.abs(upper.mean(axis=1) - center)[upperIndexes]
+        return drift * DRIFT_COST
+
+    costs = register(candidates[0])
+    # voicing of the chord before that each voicing is reached from most cheaply
+    steps = []
+    for index in range(1, len(chords)):
+        total = costs[None, :] + transition(chords[index - 1], chords[index])
+        best = total.argmin(axis=1)
+        steps.append(best)
+        costs = total[np.arange(len(best)), best] + register(candidates[index])
+
+    choice = int(costs.argmin())
+    voiced_chords = [candidates[-1][0][choice]]
+    for options, best in zip(candidates[-2::-1], steps[::-1]):
+        choice = int(best[choice])
+        voiced_chords.append(options[0][choice])
+    return [sorted(chord.tolist()) for chord in voiced_chords[::-1]]
+
+
+################################################################################
+# Chord class                                                                  #
+################################################################################
+class Chord:
+    """A chord parsed from its name ('C', 'Fmin6', 'Bb7#9', 'C/G', 'ii7', ...).
+
+    Args:
+    string : str
+        name of the chord
+    """
+
+    def __init__(self, string):
+        self.string = string
+        self.degrees = {}
+
+        string += " "
+        self.split = []
+        sect = ""
+
+        notes = list(NOTE_TO_PITCH.keys())
+        rms = list(RM_TO_PITCH.keys())
+        accs = list(ACC_TO_SHIFT.keys())
+        modes = list(TEXT_TO_MODE.keys())
+
+        root_added = False
+        mode_added = False
+
+        is_roman_numeral = False
+        is_slash_chord = False
+        is_maj7 = False
+
+        for i in range(0, len(string) - 1):
+            sect += string[i]
+            curr_char = string[i].lower()
+            next_char = string[i + 1].lower()
+
+            root_found = not root_added and (
+                curr_char in notes + rms + accs and next_char not in rms + accs
+            )
+            mode_found = False
+            num_found = curr_char.isdigit() and not next_char.isdigit()
+
+            if (
+                (i == len(string) - 2)
+                or root_found
+                or num_found
+                or next_char == "/"
+                or curr_char == ")"
+            ):
+                if root_found:
+                    self.root = sect
+                    root_added = True
+
+                    is_roman_numeral = self.root in rms
+                elif sect[0] == "/":
+                    # case for 6/9 chords
+                    if sect[1] == "9":
+                        self.degrees[9] = 0
+                    else:
+                        is_slash_chord = True
+                        self.bassnote = sect[1 : len(sect)]
+                else:
+                    if not mode_added:
+                        for mode in modes:
+                            mode_found = mode in sect[0 : len(mode)]
+                            if mode_found:
+                                self.mode = TEXT_TO_MODE[mode]
+                                mode_added = True
+                                break
+
+                    if not mode_added:
+                        if not is_roman_numeral and str(get_number(sect)) == sect:
+                            self.mode = Mode.DOM
+                            mode_found = True
+                            mode_added = True
+
+                    deg = get_number(sect)
+                    if deg is not None:
+                        shift = 0
+
+                        for char in sect:
+                            if char == "#":
+                                shift += 1
+                            elif char == "b":
+                                shift -= 1
+
+                        if (not mode_found) or deg % 2 == 0:
+                            self.degrees[deg] = shift
+                        elif deg >= 7:
+                            for i_ in range(7, deg + 1):
+                                if i_ % 2 != 0:
+                                    self.degrees[i_] = shift
+
+                self.split.append(sect)
+                sect = ""
+
+        if not root_added:
+            raise ValueError(f"{self.string!r} has no root")
+
+        if not mode_added:
+            # Case for minor roman numeral chords
+            if self.root in rms and self.root == self.root.lower():
+                self.mode = Mode.MIN
+            else:
+                self.mode = Mode.DOM
+
+        if not is_slash_chord:
+            self.bassnote = self.root
+
+        for sect in self.split:
+            is_maj7 = ("maj" in sect) or is_maj7
+
+        if (7 in self.degrees.keys()) and not is_maj7:
+            self.degrees[7] = -1
+
+    def get_midi(self, key="c", octave=4):
+        """returns the chord's midi pitches, the bass note an octave below the root first"""
+        notes = {}
+
+        notes[0] = text_to_pitch(self.bassnote, key) - 12
+
+        root = text_to_pitch(self.root, key)
+        notes[1] = root
+        notes[3] = root + degree_to_shift(3) + MODE_TO_SHIFT[self.mode][3]
+        notes[5] = root + degree_to_shift(5) + MODE_TO_SHIFT[self.mode][5]
+
+        for deg in self.degrees.keys():
+            notes[deg] = root + degree_to_shift(deg) + self.degrees[deg]
+
+        for deg in notes.keys():
+            notes[deg] += 12 * octave
+
+        return list(notes.values())
+
+
+################################################################################
+# MUSICXML                                                                     #
+################################################################################
+@lru_cache(maxsize=CACHE_SIZE)
+def chord_pitches(chord, key="c", octave=4):
+    """Returns the midi pitches of a chord name, parsing each (chord, key, octave) once.
+
+    Args:
+    chord : str
+        name of the chord, see Chord
+    key : str
+        key roman numerals are read in
+    octave : int
+        octave of the root
+
+    Returns:
+        a tuple of midi pitches, the bass note first
+    """
+    return tuple(Chord(chord).get_midi(key, octave))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def chord_fragment(pitches, duration, chord_start=True, chord_end=True):
+    """Returns the serialized note elements of a chord.
+
+    Args:
+    pitches : tuple
+        midi pitches of the chord, an empty tuple for a rest
+    duration : int
+        number of divisions the chord lasts
+    chord_start, chord_end : bool
+        False if the chord is tied from a previous, or to a following, chord
+
+    Returns:
+        the chord's note elements as a string, its notes after the first
+        marked with <chord/>
+    """
+    if not pitches:
+        notes = create_rest(duration)
+    else:
+        pitches = sorted(set(pitches))
+        for pitch in pitches:
+            if not 0 <= pitch < 128:
+                raise ValueError(f"pitch {pitch} is outside the midi range")
+        notes = create_chord(
+            [(pitch, chord_start, chord_end) for pitch in pitches], duration
+        )
+    return "".join(ET.tostring(note, encoding="unicode") for note in notes)
+
+
+@lru_cache(maxsize=None)
+def measure_attributes(clef_type):
+    """returns the serialized attributes of a progression's first measure (4/4, C major)"""
+    return ET.tostring(
+        write_measure_attributes(1, 0, pretty_midi.TimeSignature(4, 4, 0), clef_type),
+        encoding="unicode",
+    )
+
+
+def progression_pitches(progression, key="c", octave=4, voice_leading=False):
+    """Returns the midi pitches of each chord of a progression.
+
+    '-' repeats the previous chord and 'nc' is a rest (an empty tuple).
+    """
+    chords = []
+    for name in progression:
+        # spaces within a name are dropped: 'B min7' is 'Bmin7' and 'F# 7 / E' is 'F#7/E'
+        name = "".join(name.split())
+        if name == "-" and chords:
+            chords.append(chords[-1])
+        elif name.lower() in NO_CHORD:
+            chords.append(())
+        else:
+            chords.append(chord_pitches(name, key, octave))
+    if voice_leading and any(chords):
+        voiced = iter(voice([list(chord) for chord in chords if chord]))
+        chords = [tuple(next(voiced)) if chord else () for chord in chords]
+    return chords
+
+
+def chord_progression_to_xml(
+    progression, key="c", octave=4, chord_duration=1, voice_leading=False
+):
+    """Renders a chord progression as a one part musicxml score in 4/4.
+
+    Chord names are parsed once per (chord, key, octave) and each distinct
+    chord is rendered once, so batches of progressions drawing on the same
+    chords only concatenate cached fragments.
+
+    Args:
+    progression : list
+        chord names, see progression_pitches
+    key : str
+        key roman numerals are read in
+    octave : int
+        octave of each chord's root
+    chord_duration : float
+        quarter notes each chord lasts; chords are tied over barlines
+    voice_leading : bool
+        voice the chords (inversions and octaves) to move as little as they can, see voice
+
+    Returns:
+        the score as utf-8 bytes
+    """
+    chords = progression_pitches(progression, key, octave, voice_leading)
+    # 24 divisions per quarter note, 4/4
+    measureDivisions = 96
+    duration = round(chord_duration * 24)
+    allPitches = [pitch for chord in chords for pitch in chord]
+    treble = sum(pitch >= 60 for pitch in allPitches)
+    clef_type = "treble" if treble >= len(allPitches) - treble else "bass"
+
+    measures = []
+    current = []
+    position = 0
+    for pitches in chords:
+        remaining = duration
+        while remaining > 0:
+            length = min(remaining, measureDivisions - position)
+            current.append(
+                chord_fragment(
+                    pitches, length, remaining == duration, remaining == length
+                )
+            )
+            remaining -= length
+            position += length
+            if position == measureDivisions:
+                measures.append(current)
+                current = []
+                position = 0
+    if current or not measures:
+        if position < measureDivisions:
+            current.append(chord_fragment((), measureDivisions - position))
+        measures.append(current)
+
+    # the attributes never change, so only the first measure has them
+    measures[0].insert(0, measure_attributes(clef_type))
+    parts = [
+        f'<measure number="{number}">{"".join(fragments)}</measure>'
+        for number, fragments in enumerate(measures, 1)
+    ]
+    score = (
+        "<?xml version='1.0' encoding='UTF8'?>\n<score-partwise>"
+        '<part-list><score-part id="P1"><part-name>Chords</part-name></score-part>'
+        '</part-list><part id="P1">' + "".join(parts) + "</part></score-partwise>"
+    )
+    return score.encode("utf-8")
+
+
+def chord_progression_to_midi(
+    progression, key="c", octave=4, chord_duration=1, voice_leading=False, tempo=120
+):
+    """Renders a chord progression as midi, one instrument playing each chord in turn.
+
+    Args:
+    progression : list
+        chord names, see progression_pitches
+    key, octave, chord_duration, voice_leading
+        see chord_progression_to_xml
+    tempo : float
+        quarter notes per minute
+
+    Returns:
+        a PrettyMIDI object in 4/4
+    """
+    chords = progression_pitches(progression, key, octave, voice_leading)
+    song = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    instrument = pretty_midi.Instrument(0, name="Chords")
+    seconds = chord_duration * 60.0 / tempo
+    for index, pitches in enumerate(chords):
+        for pitch in sorted(set(pitches)):
+            instrument.notes.append(
+                pretty_midi.Note(
+                    DEFAULT_VELOCITY, pitch, index * seconds, (index + 1) * seconds
+                )
+            )
+    song.instruments.append(instrument)
+    return song
@@ -1,7 +1,34 @@
-from magenta.music import musicxml_reader
-import magenta.music
-import pretty_midi
+import hashlib
+import heapq
+import io
+import json
+import math
+import os
+import time
+import warnings
 import xml.etree.ElementTree as ET
+import zipfile
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from operator import itemgetter
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+import pretty_midi
+
+# divisions per quarter note of every score written
+DIVISIONS = 24
+
+# contents of the mimetype and META-INF/container.xml entries of a compressed .mxl file
+MXL_MIMETYPE = "application/vnd.recordare.musicxml"
+MXL_CONTAINER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    "<container>"
+    "<rootfiles><rootfile full-path={} "
+    'media-type="application/vnd.recordare.musicxml+xml"/></rootfiles>'
+    "</container>\n"
+)
 
 """given the current measure, number of accidentals in the key (- for flats, + for sharps), and the current time signature,
 returns an element containing attributes for the current measure"""
@@ -15,26 +42,31 @@ def write_measure_attributes(
 
     Args:
         current_measure (str): The current measure.
-        key_accidentals (int): The number of key accidentals.
-        time_signature (Fraction): The time signature.
-        clef_type (str): The type of clef.
+        key_accidentals (int): The number of key accidentals, None to leave the key out.
+        time_signature (Fraction): The time signature, None to leave it out.
+        clef_type (str): The type of clef, None to leave it and the divisions out.
 
     Returns:
         Element: The attributes XML element.
 
     """
     attributes = ET.Element("attributes")
-    # smallest note size possible, in fractions of quarter notes. 8 allows notes as small as 32nd notes
-    divisions = ET.SubElement(attributes, "divisions")
-    divisions.text = "24"
-    key = ET.SubElement(attributes, "key")
-    fifths = ET.SubElement(key, "fifths")
-    fifths.text = str(key_accidentals)
-    time = ET.SubElement(attributes, "time")
-    beats = ET.SubElement(time, "beats")
-    beats.text = str(time_signature.numerator)
-    beatType = ET.SubElement(time, "beat-type")
-    beatType.text = str(time_signature.denominator)
+    if clef_type is not None:
+        # smallest note size possible, in fractions of quarter notes. 8 allows notes as small as 32nd notes
+        divisions = ET.SubElement(attributes, "divisions")
+        divisions.text = str(DIVISIONS)
+    if key_accidentals is not None:
+        key = ET.SubElement(attributes, "key")
+        fifths = ET.SubElement(key, "fifths")
+        fifths.text = str(key_accidentals)
+    if time_signature is not None:
+        time = ET.SubElement(attributes, "time")
+        beats = ET.SubElement(time, "beats")
+        beats.text = str(time_signature.numerator)
+        beatType = ET.SubElement(time, "beat-type")
+        beatType.text = str(time_signature.denominator)
+    if clef_type is None:
+        return attributes
     # treble is G2, bass is F4 (else assumes treble)
     clef = ET.SubElement(attributes, "clef")
     sign = ET.SubElement(clef, "sign")
@@ -44,73 +76,101 @@ def write_measure_attributes(
     return attributes
 
 
+# note values durations are split into, longest first: (shortest duration, in divisions,
+# that uses the value, type, dots, divisions). A quarter note is used above 22 divisions,
+# hence the bound just past 22
+NOTE_VALUES = (
+    (190, "breve", 0, 192),
+    (166, "whole", 2, 168),
+    (142, "whole", 1, 144),
+    (94, "whole", 0, 96),
+    (82, "half", 2, 84),
+    (70, "half", 1, 72),
+    (46, "half", 0, 48),
+    (40, "quarter", 2, 42),
+    (34, "quarter", 1, 36),
+    (math.nextafter(22, math.inf), "quarter", 0, 24),
+    (20, "eighth", 2, 21),
+    (16, "eighth", 1, 18),
+    (10, "eighth", 0, 12),
+    (8, "16th", 1, 9),
+    (4, "16th", 0, 6),
+)
+
+
+def split_duration(note_duration):
+    """Splits a duration into the note values needed to write it.
+
+    Args:
+    note_duration : int
+        number of divisions the note lasts
+
+    Returns:
+        a tuple of (type, dots, divisions) segments to be tied together; the
+        last segment takes whatever divisions the others leave over
+    """
+    segments = []
+    remaining = note_duration
+    while remaining >= 4:
+        for low, noteType, dots, divisions in NOTE_VALUES:
+            if remaining >= low:
+                segments.append((noteType, dots, divisions))
+                remaining -= divisions
+                break
+    if not segments:
+        return (("32nd", 0, note_duration),) if note_duration > 0 else ()
+    noteType, dots, _ = segments[-1]
+    segments[-1] = (noteType, dots, note_duration - sum(s[2] for s in segments[:-1]))
+    return tuple(segments)
+
+
+# largest duration (in divisions) in NOTE_SEGMENTS; four breves covers a measure of 32/4
+MAX_TABLE_DIVISIONS = 768
+# segments of every whole duration from 0 up to MAX_TABLE_DIVISIONS, see split_duration
+NOTE_SEGMENTS = tuple(split_duration(d) for d in range(MAX_TABLE_DIVISIONS + 1))
+
+
+def note_segments(note_duration):
+    """returns the (type, dots, divisions) segments of a duration, see split_duration"""
+    if 0 <= note_duration <= MAX_TABLE_DIVISIONS and note_duration == int(
+        note_duration
+    ):
+        return NOTE_SEGMENTS[int(note_duration)]
+    return split_duration(note_duration)
 
 
 def get_note_type(note_duration):
-  """returns note type (whole note, half note, etc.)"""
-    note_type = ""
-    while note_duration >= 4:
-        if note_type != "":
-            note_type += "+"
-        # length 192
-        if note_duration >= 190:
-            note_duration -= 192
-            note_type += "breve"
-        elif note_duration >= 166:
-            note_duration -= 168
-            note_type += "ddwhole"
-        elif note_duration >= 142:
-            note_duration -= 144
-            note_type += "dwhole"
-        elif note_duration >= 94:
-            note_duration -= 96
-            note_type += "whole"
-        elif note_duration >= 82:
-            note_duration -= 84
-            note_type += "ddhalf"
-        elif note_duration >= 70:
-            note_duration -= 72
-            note_type += "dhalf"
-        elif note_duration >= 46:
-            note_duration -= 48
-            note_type += "half"
-        elif note_duration >= 40:
-            note_duration -= 42
-            note_type += "ddquarter"
-        elif note_duration >= 34:
-            note_duration -= 36
-            note_type += "dquarter"
-        elif note_duration > 22:
-            note_duration -= 24
-            note_type += "quarter"
-        elif note_duration >= 20:
-            note_duration -= 21
-            note_type += "ddeighth"
-        elif note_duration >= 16:
-            note_duration -= 18
-            note_type += "deighth"
-        elif note_duration >= 10:
-            note_duration -= 12
-            note_type += "eighth"
-        elif note_duration >= 8:
-            note_duration -= 9
-            note_type += "d16th"
-        else:
-            note_duration -= 6
-            note_type += "16th"
-    if note_type == "" and note_duration > 0:
-        return "32nd"
-    return note_type[:-1] if note_type[-1] == "+" else note_type
+    """returns note type (whole note, half note, etc.), with '+' between tied
+    values and a 'd' per dot ('half+deighth', 'ddquarter', '16th', etc.)"""
+    return "+".join(
+        "d" * dots + noteType for noteType, dots, _ in note_segments(note_duration)
+    )
+
+
+def parse_note_name(note_name):
+    """returns the (step, alter, octave) texts of a note name such as 'C#4', alter None for naturals"""
+    # checks for accidentals (only natural/sharp/flat)
+    alter = None
+    if len(note_name) == 3 and note_name[1] != chr(9838):
+        # sharp
+        alter = "1" if note_name[1] in [chr(9839), "#"] else "-1"
+    return str(note_name[0]), alter, str(note_name[-1])
+
+
+# (step, alter, octave) texts of each midi pitch, spelled as pretty_midi names them
+PITCH_SPELLINGS = tuple(
+    parse_note_name(pretty_midi.note_number_to_name(pitch)) for pitch in range(128)
+)
 
 
 """
 creates a note Element
 note_name
-    string containing name of note's pitch (C4, D#6, A2, etc.)
+    string containing name of note's pitch (C4, D#6, A2, etc.), or its midi pitch number
 note_duration
     integer containing the nuber of divisions the note lasts
 note_type
-    string containing note type(s) needed to create a note ('half+eighth', 'ddquarter', '16th', etc.)
+    deprecated and ignored, the note values are worked out from note_duration
 note_start
     False if this note is tied to a previous note (this isn't the start of the note)
 note_end
@@ -118,354 +178,1437 @@ note_end
 note_voice
     integer representing voice of part (for instruments that play multiple notes at once)
 
-returns: note Element
+returns: list of note Elements
 """
 
 
 def create_note(
-    note_name, note_duration, note_type, note_start=True, note_end=True, note_voice=1
+    note_name,
+    note_duration,
+    note_type=None,
+    note_start=True,
+    note_end=True,
+    note_voice=1,
 ):
+    if note_type is not None:
+        warnings.warn(
+            "create_note's note_type is ignored; note values come from note_duration",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+    if isinstance(note_name, str):
+        noteStep, noteAlter, noteOctave = parse_note_name(note_name)
+    else:
+        noteStep, noteAlter, noteOctave = PITCH_SPELLINGS[note_name]
     # if impossible to create note of correct duration with 1 note, creates multiple and ties them together
     # example: duration of half note + eighth note cannot be made using a single valid note duration
-    compoundNote = True
+    segments = note_segments(note_duration)
     notes = []
-    splitPoint = 0
-    while compoundNote:
-        prevSplit = splitPoint
-        splitPoint = str(note_type).find("+", (prevSplit + 1))
-        if splitPoint == -1:
-            compoundNote = False
+    for index, (noteType, dots, divisions) in enumerate(segments):
         # create note
         currentNote = ET.Element("note")
         pitch = ET.SubElement(currentNote, "pitch")
         step = ET.SubElement(pitch, "step")
-        step.text = str(note_name[0])
-        # checks for accidentals (only natural/sharp/flat)
-        if len(note_name) == 3 and note_name[1] != chr(9838):
+        step.text = noteStep
+        if noteAlter is not None:
             alter = ET.SubElement(pitch, "alter")
-            # sharp
-            alter.text = "1" if note_name[1] in [chr(9839), "#"] else "-1"
+            alter.text = noteAlter
         octave = ET.SubElement(pitch, "octave")
-        octave.text = str(note_name[-1])
-        # determines length of current note, in case of multiple notes
-        if splitPoint == -1:
-            currentNoteType = (
-                str(note_type) if prevSplit == 0 else str(note_type[(prevSplit + 1) :])
-            )
-        elif prevSplit == 0:
-            currentNoteType = str(note_type[:splitPoint])
-        else:
-            currentNoteType = str(note_type[(prevSplit + 1) : splitPoint])
-
+        octave.text = noteOctave
         # duration of current note
-        if compoundNote:
-            noteDuration = 1
-            if "breve" in currentNoteType:
-                noteDuration = 192
-            elif "whole" in currentNoteType:
-                noteDuration = 96
-            elif "half" in currentNoteType:
-                noteDuration = 48
-            elif "quarter" in currentNoteType:
-                noteDuration = 24
-            elif "eighth" in currentNoteType:
-                noteDuration = 12
-            elif "16th" in currentNoteType:
-                noteDuration = 6
-            elif "32nd" in currentNoteType:
-                noteDuration = 3
-
-            if "dd" in currentNoteType:
-                noteDuration *= 1.75
-            elif "d" in currentNoteType:
-                noteDuration *= 1.5
-            noteDuration = round(noteDuration)
-            note_duration -= noteDuration
-        else:
-            noteDuration = note_duration
         duration = ET.SubElement(currentNote, "duration")
-        duration.text = str(noteDuration)
+        duration.text = str(divisions)
 
         # ties
-        if not note_start or prevSplit != 0:
+        if not note_start or index != 0:
             ET.SubElement(currentNote, "tie", type="stop")
-        if not note_end or splitPoint != -1:
+        if not note_end or index != len(segments) - 1:
             ET.SubElement(currentNote, "tie", type="start")
         voice = ET.SubElement(currentNote, "voice")
         voice.text = str(note_voice)
         note_type = ET.SubElement(currentNote, "type")
-        if currentNoteType[:2] == "dd":
-            note_type.text = currentNoteType[2:]
-            ET.SubElement(currentNote, "dot")
-            ET.SubElement(currentNote, "dot")
-        elif currentNoteType[0] == "d":
-            note_type.text = currentNoteType[1:]
+        note_type.text = noteType
+        for _ in range(dots):
             ET.SubElement(currentNote, "dot")
-        else:
-            note_type.text = currentNoteType
         notes.append(currentNote)
     return notes
 
 
-def read_from_xml(xml_file):
+def create_chord(chord_notes, chord_duration, chord_voice=1):
+    """Creates the note Elements of notes starting together and lasting as long.
+
+    Args:
+    chord_notes : list
+        (pitch, note_start, note_end) of each note of the chord, see create_note
+    chord_duration : int
+        number of divisions the chord lasts
+    chord_voice : int
+        voice of the chord
+
+    Returns:
+        list of note Elements, the notes after the first of each tied value
+        marked with <chord/>
+    """
+    values = []
+    for index, (pitch, noteStart, noteEnd) in enumerate(chord_notes):
+        noteValues = create_note(
+            pitch, chord_duration, None, noteStart, noteEnd, chord_voice
+        )
+        if index != 0:
+            # a chord's notes after the first start with <chord/>, each tied value alike
+            for note in noteValues:
+                note.insert(0, ET.Element("chord"))
+        values.append(noteValues)
+    # tied values of the chord follow each other, every note of the chord at each
+    return [note for chordValues in zip(*values) for note in chordValues]
+
+
+def create_rest(rest_duration):
+    """Creates the rest Elements filling a duration.
+
+    Args:
+    rest_duration : int
+        number of divisions the rest lasts
+
+    Returns:
+        list of note Elements, one rest per note value the duration is split into
+    """
+    rests = []
+    for noteType, dots, divisions in note_segments(rest_duration):
+        currentNote = ET.Element("note")
+        ET.SubElement(currentNote, "rest")
+        duration = ET.SubElement(currentNote, "duration")
+        duration.text = str(divisions)
+        note_type = ET.SubElement(currentNote, "type")
+        note_type.text = noteType
+        for _ in range(dots):
+            ET.SubElement(currentNote, "dot")
+        rests.append(currentNote)
+    return rests
+
+
+def tempo_map(song):
+    """Returns (resolution, tick scales) of a PrettyMIDI object.
+
+    These are its ticks per quarter note and the (tick, seconds per tick) of each tempo.
+    """
+    # pretty_midi keeps the tempo map it converts ticks with in _tick_scales
+    return song.resolution, song._tick_scales
+
+
+def tempo_segments(scales):
+    """Returns the ticks, seconds per tick and start times of a song's tempos.
+
+    Start times are summed the way pretty_midi sums them, so times computed
+    from them are the ones pretty_midi computes.
+
+    Args:
+    scales : list
+        (tick, seconds per tick) of each tempo, see tempo_map
+
+    Returns:
+        a tuple (ticks, perTick, startTimes) of arrays, one entry per tempo
+    """
+    startTimes = [0.0]
+    for (start, scale), (end, _) in zip(scales[:-1], scales[1:]):
+        startTimes.append(startTimes[-1] + scale * (end - start))
+    ticks = np.array([tick for tick, _ in scales], dtype=np.int64)
+    perTick = np.array([scale for _, scale in scales])
+    return ticks, perTick, np.array(startTimes)
+
+
+def seconds_to_ticks(times, scales):
+    """returns the nearest tick of each time in seconds, through the tempo map scales (see tempo_map)"""
+    ticks, perTick, startTimes = tempo_segments(scales)
+    times = np.asarray(times, dtype=float)
+    segments = np.maximum(np.searchsorted(startTimes, times, side="right") - 1, 0)
+    return ticks[segments] + np.rint(
+        (times - startTimes[segments]) / perTick[segments]
+    ).astype(np.int64)
+
+
+def ticks_to_divisions(ticks, resolution, snap=1):
+    """Converts ticks to divisions, rounding to the nearest multiple of snap divisions.
+
+    Only integers are used, so a position converts to the same division
+    whatever tempo it is played at and wherever it is in the song.
+
+    Args:
+    ticks : np.ndarray
+        integer positions, in ticks
+    resolution : int
+        ticks per quarter note
+    snap : int
+        divisions positions are rounded to a multiple of (6 for sixteenth notes)
+
+    Returns:
+        an int64 array of the positions in divisions, halves rounded up
+    """
+    unit = resolution * snap
+    ticks = np.asarray(ticks, dtype=np.int64)
+    return ((2 * DIVISIONS * ticks + unit) // (2 * unit)) * snap
+
+
+def measure_grid(
+    time_signatures,
+    key_signatures,
+    end_time,
+    resolution,
+    scales,
+    snap=1,
+    last_start=None,
+):
+    """Lays out the measures of a song, in divisions from its start.
+
+    Measures follow each other at the length of their time signature; a
+    time signature change starts a new measure, cutting the one before it
+    short if it falls inside it. The first time signature holds from the
+    start, and measures are laid out until end_time is reached, and past
+    it until the last note, quantized, fits.
+
+    Args:
+    time_signatures, key_signatures : list
+        pretty_midi TimeSignature and KeySignature changes of the song, at
+        least one of each, in time order
+    end_time : float
+        time the song ends at, in seconds
+    resolution, scales : int, list
+        the song's tempo map, see tempo_map
+    snap : int
+        divisions note positions are rounded to a multiple of, see ticks_to_divisions
+    last_start : float
+        time the last note starts at, in seconds, None if the song has no notes
+
+    Returns:
+        a tuple (resolution, scales, snap, downbeats, nextDownbeats,
+        sigIndexes, keyIndexes) holding the tempo map and snap notes are
+        quantized with and, for each measure, the division it starts and
+        ends at and the index of its time and key signature
+    """
+    sigStarts = ticks_to_divisions(
+        seconds_to_ticks([sig.time for sig in time_signatures], scales), resolution
+    )
+    sigStarts[0] = 0
+    end = int(
+        ticks_to_divisions(seconds_to_ticks([end_time], scales), resolution, snap)[0]
+    )
+    if last_start is not None:
+        # a note starting where the song ends, once rounded, still lasts a
+        # snap (see quantize_part); no note ends later, as end_time is after
+        # every note's end and rounding keeps their order
+        lastStart = ticks_to_divisions(
+            seconds_to_ticks([last_start], scales), resolution, snap
+        )[0]
+        end = max(end, int(lastStart) + snap)
+    downbeats = []
+    sigIndexes = []
+    for index, sig in enumerate(time_signatures):
+        start = int(sigStarts[index])
+        if index + 1 < len(time_signatures):
+            stop = int(sigStarts[index + 1])
+            if stop <= start:
+                # replaced by a later change at the same division
+                continue
+        else:
+            stop = max(end, start + 1)
+        length = DIVISIONS * 4 * sig.numerator // sig.denominator
+        measureStarts = np.arange(start, stop, length, dtype=np.int64)
+        downbeats.append(measureStarts)
+        sigIndexes.append(np.full(len(measureStarts), index))
+    downbeats = np.concatenate(downbeats)
+    nextDownbeats = np.append(downbeats[1:], downbeats[-1] + length)
+    keyStarts = ticks_to_divisions(
+        seconds_to_ticks([key.time for key in key_signatures], scales), resolution
+    )
+    keyIndexes = np.maximum(np.searchsorted(keyStarts, downbeats, side="right") - 1, 0)
+    return (
+        resolution,
+        scales,
+        snap,
+        downbeats,
+        nextDownbeats,
+        np.concatenate(sigIndexes),
+        keyIndexes,
+    )
+
+
+def quantize_notes(starts, ends, pitches, downbeats, nextDownbeats):
+    """Works out the division positions of notes within measures, one batch per part.
+
+    Every note is assigned, with np.searchsorted against downbeats, to the
+    measure it starts in and every measure it carries over into. For each
+    (measure, note) entry the positions the writer needs are worked out
+    relative to that measure's downbeats. Positions are integers, so they
+    add up exactly. Entries are grouped by measure and keep the part's
+    original note order within each measure.
+
+    Args:
+    starts, ends : np.ndarray
+        start and end of each note of a part, in divisions
+    pitches : np.ndarray
+        midi pitch of each note
+    downbeats, nextDownbeats : np.ndarray
+        division each measure starts and ends at, see measure_grid
+
+    Returns:
+        a dict of typed arrays, one entry per (measure, note); entries of
+        measure i are bounds[i]:bounds[i + 1], "measure" is the index of the
+        entry's measure and "pitch" its note's pitch, and each division
+        position is relative to that measure's downbeat ("start", "end") or
+        to the next downbeat ("startNext", "endNext"), "length" is the
+        note's length and "toNext" the divisions from its start to the next
+        downbeat
+    """
+    first = np.maximum(np.searchsorted(downbeats, starts, side="right") - 1, 0)
+    last = np.minimum(
+        np.searchsorted(downbeats, ends, side="left") - 1, len(downbeats) - 1
+    )
+    counts = np.maximum(last - first + 1, 1)
+    # one entry per (note, measure) pair, ordered by measure then note
+    notes = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    measures = np.repeat(first, counts) + offsets
+    order = np.argsort(measures, kind="stable")
+    notes = notes[order]
+    measures = measures[order]
+    noteStarts = starts[notes]
+    noteEnds = ends[notes]
+    downbeat = downbeats[measures]
+    nextDownbeat = nextDownbeats[measures]
+
+    def divisions(positions):
+        return positions.astype(np.int32)
+
+    return {
+        "bounds": np.searchsorted(measures, np.arange(len(downbeats) + 1)),
+        "measure": measures.astype(np.int32),
+        "pitch": pitches[notes],
+        "start": divisions(noteStarts - downbeat),
+        "startNext": divisions(noteStarts - nextDownbeat),
+        "end": divisions(noteEnds - downbeat),
+        "endNext": divisions(noteEnds - nextDownbeat),
+        "length": divisions(noteEnds - noteStarts),
+        "toNext": divisions(nextDownbeat - noteStarts),
+    }
+
+
+# semitones above C of each step, used to read pitches
+STEP_TO_SEMITONE = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+# velocity of notes with no dynamics (MusicXML dynamics are percentages of forte, velocity 90)
+DEFAULT_VELOCITY = 64
+FORTE_VELOCITY = 90
+# quarter notes per minute until a tempo is given
+DEFAULT_TEMPO = 120.0
+
+
+def open_musicxml(xml_file):
+    """Opens a musicxml file for reading, looking inside .mxl archives for the score.
+
+    Args:
+    xml_file : str or file object
+        path to, or seekable binary file object of, a musicxml or compressed .mxl file
+
+    Returns:
+        a binary file object positioned at the start of the score
+    """
+    if hasattr(xml_file, "read"):
+        isArchive = zipfile.is_zipfile(xml_file)
+        xml_file.seek(0)
+        if not isArchive:
+            return xml_file
+    elif not zipfile.is_zipfile(xml_file):
+        return open(xml_file, "rb")
+    archive = zipfile.ZipFile(xml_file)
+    scoreName = None
+    if "META-INF/container.xml" in archive.namelist():
+        rootfile = ET.fromstring(archive.read("META-INF/container.xml")).find(
+            ".//rootfile"
+        )
+        if rootfile is not None:
+            scoreName = rootfile.get("full-path")
+    if scoreName is None:
+        scoreName = next(
+            name
+            for name in archive.namelist()
+            if not name.startswith("META-INF/") and name.endswith((".xml", ".musicxml"))
+        )
+    # the score stays readable after the archive is closed
+    score = archive.open(scoreName)
+    archive.close()
+    return score
+
+
+def quarters_to_seconds(tempos):
+    """Builds a function converting positions in quarter notes to seconds.
+
+    Args:
+    tempos : list
+        (position in quarter notes, quarter notes per minute) of each tempo, sorted by position
+
+    Returns:
+        a function taking a position in quarter notes and returning its time in seconds
+    """
+    positions = [position for position, _ in tempos]
+    starts = [0.0]
+    for (position, qpm), (nextPosition, _) in zip(tempos, tempos[1:]):
+        starts.append(starts[-1] + (nextPosition - position) * 60.0 / qpm)
+
+    def to_seconds(quarters):
+        index = max(bisect_right(positions, quarters) - 1, 0)
+        position, qpm = tempos[index]
+        return starts[index] + (quarters - position) * 60.0 / qpm
+
+    return to_seconds
+
+
+def read_from_xml(xml_file, use_magenta=False, stats=None):
     """Reads an xml file into a prettyMIDI object.
 
+    The score is parsed incrementally and each measure is dropped once it is
+    read, so memory use stays small. Notes, ties, chords, backup/forward,
+    tempos, time signatures and key signatures are read; tempos, time and key
+    signatures are taken from the first part. magenta's reader can be used
+    instead if it is installed.
+
     Args:
-    xml_file : str
-        path to a musicxml file
+    xml_file : str or file object
+        path to, or seekable binary file object of, a musicxml or compressed .mxl file
+    use_magenta : bool
+        read the file with magenta.music's musicxml reader
+    stats : ConversionStats
+        collects the time spent parsing and timing notes, and counts of what is
+        read; magenta's reader is timed as a whole
 
     Returns:
         a prettyMIDI object
     """
-    xml_note_sequence = musicxml_reader.musicxml_file_to_sequence_proto(xml_file)
-    return magenta.music.sequence_proto_to_pretty_midi(xml_note_sequence)
+    if use_magenta:
+        import magenta.music
+        from magenta.music import musicxml_reader
+
+        with stage(stats, "magenta"):
+            xml_note_sequence = musicxml_reader.musicxml_file_to_sequence_proto(
+                xml_file
+            )
+            song = magenta.music.sequence_proto_to_pretty_midi(xml_note_sequence)
+        if stats is not None:
+            stats.finish()
+        return song
+
+    # instruments of each part id, with their notes' times in quarter notes until the end
+    instruments = {}
+    # midi pitch unpitched (percussion) notes of each part id are played at
+    unpitchedPitches = {}
+    tempos = []
+    timeSignatures = []
+    keySignatures = []
+    # measures read, and notes joined to an earlier note by a tie
+    measureCount = 0
+    tieCount = 0
+    with stage(stats, "parse"), open_musicxml(xml_file) as score:
+        events = ET.iterparse(score, events=("start", "end"))
+        _, root = next(events)
+        if root.tag != "score-partwise":
+            raise ValueError(f"{xml_file} is not a partwise musicxml score")
+        firstPart = None
+        for event, elem in events:
+            tag = elem.tag
+            if event == "start":
+                if tag == "part":
+                    part = elem
+                    partId = part.get("id")
+                    if firstPart is None:
+                        firstPart = partId
+                    if partId not in instruments:
+                        instruments[partId] = pretty_midi.Instrument(0, name=partId)
+                    instrument = instruments[partId]
+                    # position in quarter notes, and where the last note started (for chords)
+                    position = 0.0
+                    noteStart = 0.0
+                    divisions = 1.0
+                    velocity = DEFAULT_VELOCITY
+                    # length of a measure in quarter notes, once a time signature is read
+                    measureLength = None
+                    # notes tied over to a later note, lists of them by pitch
+                    openTies = {}
+                elif tag == "measure":
+                    # where the measure starts, and the furthest position reached in it
+                    measureStart = measureEnd = position
+                    implicit = elem.get("implicit") == "yes"
+                continue
+
+            if tag == "score-part":
+                partName = elem.findtext("part-name")
+                program = elem.findtext("midi-instrument/midi-program")
+                channel = elem.findtext("midi-instrument/midi-channel")
+                unpitched = elem.findtext("midi-instrument/midi-unpitched")
+                instruments[elem.get("id")] = pretty_midi.Instrument(
+                    int(program) - 1 if program else 0,
+                    is_drum=channel is not None and int(channel) == 10,
+                    name=partName or "",
+                )
+                if unpitched:
+                    unpitchedPitches[elem.get("id")] = int(unpitched) - 1
+            elif tag == "part-list":
+                root.remove(elem)
+            elif tag == "attributes":
+                divisions = float(elem.findtext("divisions") or divisions)
+                beats = elem.findtext("time/beats")
+                beatType = elem.findtext("time/beat-type")
+                if beats and beatType:
+                    # compound meters such as 3+2 are summed
+                    meter = (sum(map(int, beats.split("+"))), int(beatType))
+                    measureLength = meter[0] * 4 / meter[1]
+                if partId == firstPart:
+                    if beats and beatType:
+                        if not timeSignatures or timeSignatures[-1][1:] != meter:
+                            timeSignatures.append((position, *meter))
+                    fifths = elem.findtext("key/fifths")
+                    if fifths is not None:
+                        minor = elem.findtext("key/mode") == "minor"
+                        tonic = (int(fifths) * 7 + (9 if minor else 0)) % 12
+                        keyNumber = tonic + (12 if minor else 0)
+                        if not keySignatures or keySignatures[-1][1] != keyNumber:
+                            keySignatures.append((position, keyNumber))
+            elif tag == "sound":
+                tempo = elem.get("tempo")
+                if tempo and partId == firstPart:
+                    if not tempos or tempos[-1][1] != float(tempo):
+                        tempos.append((position, float(tempo)))
+                if elem.get("dynamics"):
+                    velocity = round(float(elem.get("dynamics")) * FORTE_VELOCITY / 100)
+            elif tag == "backup":
+                position -= float(elem.findtext("duration")) / divisions
+            elif tag == "forward":
+                position += float(elem.findtext("duration")) / divisions
+                measureEnd = max(measureEnd, position)
+            elif tag == "note":
+                if elem.find("grace") is not None or elem.find("cue") is not None:
+                    continue
+                duration = float(elem.findtext("duration") or 0) / divisions
+                if elem.find("chord") is None:
+                    noteStart = position
+                    position += duration
+                    measureEnd = max(measureEnd, position)
+                step = elem.findtext("pitch/step")
+                if step is not None:
+                    pitch = (
+                        (int(elem.findtext("pitch/octave")) + 1) * 12
+                        + STEP_TO_SEMITONE[step]
+                        + round(float(elem.findtext("pitch/alter") or 0))
+                    )
+                elif elem.find("unpitched") is not None and partId in unpitchedPitches:
+                    pitch = unpitchedPitches[partId]
+                else:
+                    # rests
+                    continue
+                ties = {tie.get("type") for tie in elem.iter("tie")}
+                noteEnd = noteStart + duration
+                if "stop" in ties and openTies.get(pitch):
+                    # the open note of this pitch ending where this one starts,
+                    # as notes of another voice may be tied over alongside it
+                    tied = openTies[pitch]
+                    note = min(tied, key=lambda note: abs(note.end - noteStart))
+                    tied.remove(note)
+                    note.end = noteEnd
+                    tieCount += 1
+                else:
+                    dynamics = elem.get("dynamics")
+                    if dynamics:
+                        noteVelocity = round(float(dynamics) * FORTE_VELOCITY / 100)
+                    else:
+                        noteVelocity = velocity
+                    note = pretty_midi.Note(
+                        min(noteVelocity, 127), pitch, noteStart, noteEnd
+                    )
+                    instrument.notes.append(note)
+                if "start" in ties:
+                    openTies.setdefault(pitch, []).append(note)
+            elif tag == "measure":
+                # measures ending early are not padded, so the next one starts
+                # at the barline (pickups and other implicit measures excepted)
+                if measureLength is not None and not implicit:
+                    measureEnd = max(measureEnd, measureStart + measureLength)
+                position = measureEnd
+                measureCount += 1
+                # drop the finished measure, everything needed from it has been read
+                elem.clear()
+                part.remove(elem)
+            elif tag == "part":
+                root.remove(elem)
+
+    with stage(stats, "timing"):
+        tempos = tempos or [(0.0, DEFAULT_TEMPO)]
+        if tempos[0][0] > 0:
+            tempos.insert(0, (0.0, tempos[0][1]))
+        to_seconds = quarters_to_seconds(tempos)
+        song = pretty_midi.PrettyMIDI(initial_tempo=tempos[0][1])
+        # pretty_midi has no public way to add tempo changes; like magenta, set its tick scales
+        song._tick_scales = [
+            (round(position * song.resolution), 60.0 / (qpm * song.resolution))
+            for position, qpm in tempos
+        ]
+        lastQuarter = 0.0
+        for instrument in instruments.values():
+            for note in instrument.notes:
+                lastQuarter = max(lastQuarter, note.end)
+                note.start = to_seconds(note.start)
+                note.end = to_seconds(note.end)
+            song.instruments.append(instrument)
+        song._update_tick_to_time(round(lastQuarter * song.resolution) + 1)
+        for position, numerator, denominator in timeSignatures:
+            song.time_signature_changes.append(
+                pretty_midi.TimeSignature(numerator, denominator, to_seconds(position))
+            )
+        for position, keyNumber in keySignatures:
+            song.key_signature_changes.append(
+                pretty_midi.KeySignature(keyNumber, to_seconds(position))
+            )
+    if stats is not None:
+        stats.count("parts", len(song.instruments))
+        stats.count("measures", measureCount)
+        stats.count("notes", sum(len(part.notes) for part in song.instruments))
+        stats.count("ties", tieCount)
+        if isinstance(xml_file, (str, os.PathLike)):
+            stats.count("input_bytes", os.path.getsize(xml_file))
+        stats.finish()
+    return song
+
+
+class ConversionStats:
+    """Wall and cpu time spent in each stage of a conversion, and counts of what it wrote or read.
+
+    Passed to write_to_xml, write_score or read_from_xml, it is filled in as
+    the conversion runs; without one, nothing is measured.
+
+    Args:
+    callback : callable
+        called with as_dict() once write_to_xml or read_from_xml is done, see json_sink
+    """
 
+    def __init__(self, callback=None):
+        # [wall seconds, cpu seconds] of each stage
+        self.stages = {}
+        self.counts = {}
+        self.callback = callback
 
-def write_to_xml(self, midi_object, filename):
-    """writes a prettyMIDI object to a musicxml file.
+    @contextmanager
+    def stage(self, name):
+        """times the code run inside it as part of the named stage"""
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            times = self.stages.setdefault(name, [0.0, 0.0])
+            times[0] += time.perf_counter() - wall
+            times[1] += time.process_time() - cpu
+
+    def count(self, name, number=1):
+        self.counts[name] = self.counts.get(name, 0) + number
+
+    def merge(self, other):
+        """adds the stages and counts of another conversion's as_dict()"""
+        for name, times in other["stages"].items():
+            total = self.stages.setdefault(name, [0.0, 0.0])
+            total[0] += times["wall"]
+            total[1] += times["cpu"]
+        for name, number in other["counts"].items():
+            self.count(name, number)
+
+    def as_dict(self):
+        return {
+            "stages": {
+                name: {"wall": wall, "cpu": cpu}
+                for name, (wall, cpu) in self.stages.items()
+            },
+            "counts": dict(self.counts),
+        }
+
+    def finish(self):
+        if self.callback is not None:
+            self.callback(self.as_dict())
+
+
+def json_sink(file):
+    """returns a ConversionStats callback appending each conversion's stats as a json line to a text file"""
+
+    def write(stats):
+        file.write(json.dumps(stats) + "\n")
+        file.flush()
+
+    return write
+
+
+def stage(stats, name):
+    """returns stats.stage(name), or a context doing nothing without stats"""
+    return stats.stage(name) if stats is not None else nullcontext()
+
+
+class NoteStore:
+    """The notes of one part as parallel typed arrays, in the part's note order.
+
+    Conversion works on these arrays rather than on pretty_midi Note
+    objects, which take a few hundred bytes each. Indexing or iterating
+    over it gives Notes made from the arrays, so code reading a part's
+    notes (such as PrettyMIDI.write) can read it as a list; changing
+    those Notes does not change the arrays.
 
     Args:
-    midi_object : PrettyMIDI
-        midi data to be written
-    filename : str
-        path to write xml file to
+    notes : list
+        pretty_midi Notes of the part, see from_arrays to build one from arrays
+    """
+
+    def __init__(self, notes):
+        count = len(notes)
+        self.pitch = np.fromiter((note.pitch for note in notes), np.uint8, count)
+        self.velocity = np.fromiter((note.velocity for note in notes), np.uint8, count)
+        self.start = np.fromiter((note.start for note in notes), np.float64, count)
+        self.end = np.fromiter((note.end for note in notes), np.float64, count)
+        # ticks of the notes, when they were read from ticks
+        self.start_tick = None
+        self.end_tick = None
+
+    @classmethod
+    def from_arrays(cls, pitch, velocity, start, end, start_tick=None, end_tick=None):
+        """returns a NoteStore holding the given arrays, such as a midi file reader fills in"""
+        store = cls([])
+        store.pitch = np.asarray(pitch, dtype=np.uint8)
+        store.velocity = np.asarray(velocity, dtype=np.uint8)
+        store.start = np.asarray(start, dtype=np.float64)
+        store.end = np.asarray(end, dtype=np.float64)
+        if start_tick is not None:
+            store.start_tick = np.asarray(start_tick, dtype=np.int64)
+            store.end_tick = np.asarray(end_tick, dtype=np.int64)
+        return store
+
+    def ticks(self, scales):
+        """returns arrays of the start and end tick of each note, through the tempo map scales (see tempo_map)"""
+        if self.start_tick is not None:
+            return self.start_tick, self.end_tick
+        return seconds_to_ticks(self.start, scales), seconds_to_ticks(self.end, scales)
+
+    def __len__(self):
+        return len(self.pitch)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        return pretty_midi.Note(
+            int(self.velocity[index]),
+            int(self.pitch[index]),
+            float(self.start[index]),
+            float(self.end[index]),
+        )
+
+    def __iter__(self):
+        # a new Note for each note, so pretty_midi can read a part held in arrays
+        for velocity, pitch, start, end in zip(
+            self.velocity.tolist(),
+            self.pitch.tolist(),
+            self.start.tolist(),
+            self.end.tolist(),
+        ):
+            yield pretty_midi.Note(velocity, pitch, start, end)
+
+
+# quantize_notes columns each measure's notes are written from, see create_measure
+MEASURE_COLUMNS = ("pitch", "start", "startNext", "end", "endNext", "length", "toNext")
+
+
+def measure_signatures(timeSignatures, keySignatures, grid):
+    """Works out the time and key signature of each measure.
+
+    Args:
+    timeSignatures, keySignatures : list
+        pretty_midi time and key signature changes of the song
+    grid : tuple
+        the song's measures, see measure_grid
+
+    Returns:
+        lists (times, keys), one entry per measure: the TimeSignature and the
+        number of accidentals in the key of the measure
+    """
+    *_, sigIndexes, keyIndexes = grid
+    keyAccidentals = [
+        pretty_midi.key_number_to_mode_accidentals(key.key_number)[1]
+        for key in keySignatures
+    ]
+    times = [timeSignatures[index] for index in sigIndexes.tolist()]
+    keys = [keyAccidentals[index] for index in keyIndexes.tolist()]
+    return times, keys
+
+
+def quantize_part(instrument, grid, stats=None):
+    """Quantizes the notes of one part into the measures of the song.
+
+    Args:
+    instrument : Instrument
+        pretty_midi instrument the part is made from
+    grid : tuple
+        the song's measures and tempo map, see measure_grid
+    stats : ConversionStats
+        collects the time spent on clefs and quantization, None to not measure
+
+    Returns:
+        a tuple (clef_type, bounds, columns): the part's clef, and the
+        MEASURE_COLUMNS arrays of quantize_notes with the bounds of each
+        measure's notes in them
+    """
+    resolution, scales, snap, downbeats, nextDownbeats, *_ = grid
+    with stage(stats, "note_store"):
+        # instruments read by smf.read_midi already hold a NoteStore
+        notes = instrument.notes
+        if not isinstance(notes, NoteStore):
+            notes = NoteStore(notes)
+    with stage(stats, "clef"):
+        # determines if treble or bass clef (only these 2 for simplicity; no changes throughout piece),
+        # written in the first measure
+        # notes from C4 (midi 60) up count as treble
+        treble = np.count_nonzero(notes.pitch >= 60)
+        bass = len(notes) - treble
+        clef_type = "treble" if treble >= bass else "bass"
+    with stage(stats, "quantize"):
+        # note positions in divisions from the start of the song; a note
+        # rounded to nothing keeps the shortest length it can have
+        startTicks, endTicks = notes.ticks(scales)
+        starts = ticks_to_divisions(startTicks, resolution, snap)
+        ends = np.maximum(ticks_to_divisions(endTicks, resolution, snap), starts + snap)
+        # notes that start in or carry over into each measure
+        quantized = quantize_notes(starts, ends, notes.pitch, downbeats, nextDownbeats)
+        bounds = quantized["bounds"].tolist()
+        columns = [quantized[column] for column in MEASURE_COLUMNS]
+    if stats is not None:
+        stats.count("notes", len(notes))
+    return clef_type, bounds, columns
+
+
+def measure_arguments(part, times, keys, grid, first=0, stop=None):
+    """Yields the arguments of create_measure for a run of a part's measures.
+
+    The first measure of the run is written with every attribute, and the
+    ones after it with the time and key signatures that change.
+
+    Args:
+    part : tuple
+        the part's quantized notes, see quantize_part
+    times, keys : list
+        time signature and key accidentals of each measure, see measure_signatures
+    grid : tuple
+        the song's measures, see measure_grid
+    first, stop : int
+        indexes (from 0) of the first measure of the run and the measure after
+        it, None for the end of the song
+    """
+    clef_type, bounds, columns = part
+    downbeats, nextDownbeats = grid[3:5]
+    stop = len(downbeats) if stop is None else stop
+    for i in range(first, stop):
+        currentTime = times[i]
+        keyAccidentals = keys[i]
+        if i != first:
+            lastTime = times[i - 1]
+            # attributes are only written where they change
+            if (currentTime.numerator, currentTime.denominator) == (
+                lastTime.numerator,
+                lastTime.denominator,
+            ):
+                currentTime = None
+            if keyAccidentals == keys[i - 1]:
+                keyAccidentals = None
+        yield (
+            i + 1,
+            i + 1 == len(downbeats),
+            currentTime,
+            keyAccidentals,
+            clef_type if i == first else None,
+            # divisions in the measure, which is cut short by a time signature change inside it
+            int(nextDownbeats[i] - downbeats[i]),
+            tuple(column[bounds[i] : bounds[i + 1]] for column in columns),
+        )
+
+
+def part_measures(instrument, timeSignatures, keySignatures, grid, stats=None):
+    """Works out everything the measures of one part are written from.
+
+    Args:
+    instrument : Instrument
+        pretty_midi instrument the part is made from
+    timeSignatures, keySignatures : list
+        pretty_midi time and key signature changes of the song
+    grid : tuple
+        the song's measures and tempo map, see measure_grid
+    stats : ConversionStats
+        collects the time spent on clefs and quantization, None to not measure
+
+    Yields:
+        for each measure, the arguments of create_measure
+    """
+    times, keys = measure_signatures(timeSignatures, keySignatures, grid)
+    part = quantize_part(instrument, grid, stats)
+    yield from measure_arguments(part, times, keys, grid)
+
+
+def assign_voices(notes):
+    """Partitions a measure's notes into as few voices as they can be written in.
+
+    Notes are taken in order of position; each goes to the voice, of those
+    free by then, that ended last (so it follows on without a gap where it
+    can), or else starts a new voice. Heaps of the busy and free voices'
+    end positions keep this O(n log n), and it needs exactly as many voices
+    as notes sound at once at the busiest point of the measure.
+
+    Args:
+    notes : list
+        (position, duration, ...) tuples of the notes or chords of a measure
+
+    Returns:
+        a list of voices, each a list of the notes' tuples in order of position
+    """
+    voices = []
+    # (end position, voice index) of the voices still sounding, and
+    # (-end position, voice index) of the free ones, latest ending first
+    busy = []
+    free = []
+    for note in sorted(notes, key=itemgetter(0)):
+        position, duration = note[0], note[1]
+        while busy and busy[0][0] <= position:
+            end, voice = heapq.heappop(busy)
+            heapq.heappush(free, (-end, voice))
+        if free:
+            voice = heapq.heappop(free)[1]
+        else:
+            voice = len(voices)
+            voices.append([])
+        heapq.heappush(busy, (position + duration, voice))
+        voices[voice].append(note)
+    return voices
+
+
+def create_measure(
+    currentMeasure,
+    lastMeasure,
+    currentTime,
+    keyAccidentals,
+    clef_type,
+    dpm,
+    entries,
+    counts=None,
+):
+    """Creates one measure Element.
+
+    Notes starting together and lasting as long are written as one chord.
+    Chords are written voice by voice (see assign_voices), each voice's
+    chords in order with forwards over its gaps and one backup or forward
+    from the end of a voice to the first chord of the next.
+
+    Args:
+    currentMeasure : int
+        number of the measure
+    lastMeasure : bool
+        True for the last measure of the song, which every note ends in
+    currentTime : TimeSignature
+        time signature of the measure, None if it is the one of the measure before
+    keyAccidentals : int
+        number of accidentals in the key (- for flats, + for sharps), None
+        if it is the key of the measure before
+    clef_type : str
+        'treble' or 'bass', written with the divisions; None after the first measure
+    dpm : int
+        number of divisions in the measure
+    entries : tuple
+        the MEASURE_COLUMNS arrays of quantize_notes (pitch, start, startNext,
+        end, endNext, length, toNext), sliced to the notes starting in or
+        carried over into the measure
+    counts : dict
+        counts of the notes, rests, backups, forwards and tie splits (notes
+        written as several tied values) written, added to if given
+
+    Returns:
+        the measure Element
+    """
+    # elements written, for counts
+    noteCount = restCount = backupCount = forwardCount = splitCount = 0
+
+    # create measure
+    measure = ET.Element("measure", number=str(currentMeasure))
+    # attributes are only written where they change
+    if (currentTime, keyAccidentals, clef_type) != (None, None, None):
+        measure.append(
+            write_measure_attributes(
+                currentMeasure, keyAccidentals, currentTime, clef_type
+            )
+        )
+    # (pitch, starts here, ends here) of the notes written in this measure,
+    # by (position, duration), each group written as one chord
+    chords = {}
+    for pitch, noteStart, startNext, noteEnd, endNext, length, toNext in zip(
+        *[column.tolist() for column in entries]
+    ):
+        # if note starts in current measure
+        # (note starts on or after downbeat of this measure) and ((this is the last measure) or (note starts before downbeat of next measure))
+        if noteStart >= 0 and (lastMeasure or startNext < 0):
+            # if note ends in current measure
+            # (this is last measure) or (note ends before or on downbeat of next measure)
+            if lastMeasure or endNext <= 0:
+                chords.setdefault((noteStart, length), []).append((pitch, True, True))
+            else:
+                chords.setdefault((noteStart, toNext), []).append((pitch, True, False))
+        # if note is carried over from the measure before
+        elif noteStart < 0 and noteEnd > 0:
+            if lastMeasure or endNext <= 0:
+                chords.setdefault((0, noteEnd), []).append((pitch, False, True))
+            # if note continues into next measure
+            else:
+                chords.setdefault((0, dpm), []).append((pitch, False, False))
+
+    # keeps track of divisions, which is used to know current position in the measure
+    numDivisions = 0
+    # chords of each voice, in order, see assign_voices
+    for voiceNum, voice in enumerate(
+        assign_voices([(*key, sorted(notes)) for key, notes in chords.items()]), 1
+    ):
+        # one backup from the end of the voice before to the first chord of this one
+        if voice[0][0] < numDivisions:
+            backup = ET.SubElement(measure, "backup")
+            duration = ET.SubElement(backup, "duration")
+            duration.text = str(numDivisions - voice[0][0])
+            numDivisions = voice[0][0]
+            backupCount += 1
+        for position, durationNum, chordNotes in voice:
+            if numDivisions < position:
+                forward = ET.SubElement(measure, "forward")
+                duration = ET.SubElement(forward, "duration")
+                duration.text = str(position - numDivisions)
+                forwardCount += 1
+            values = create_chord(chordNotes, durationNum, voiceNum)
+            measure.extend(values)
+            numDivisions = position + durationNum
+            noteCount += len(values)
+            splitCount += len(values) - len(values) // len(chordNotes)
+
+    # if there was no note in this measure, a rest is created
+    if not chords:
+        for currentNote in create_rest(dpm):
+            measure.append(currentNote)
+            restCount += 1
+
+    if counts is not None:
+        counts["measures"] = counts.get("measures", 0) + 1
+        for name, number in (
+            ("note_elements", noteCount),
+            ("rests", restCount),
+            ("backups", backupCount),
+            ("forwards", forwardCount),
+            ("tie_splits", splitCount),
+        ):
+            counts[name] = counts.get(name, 0) + number
+    return measure
+
+
+def create_measures(instrument, timeSignatures, keySignatures, grid):
+    """Creates the measures of one part, yielding each as soon as it is finished.
+
+    Args:
+    instrument : Instrument
+        pretty_midi instrument the part is made from
+    timeSignatures, keySignatures : list
+        pretty_midi time and key signature changes of the song
+    grid : tuple
+        the song's measures and tempo map, see measure_grid
+
+    Yields:
+        a measure Element for each measure
+    """
+    for measureArgs in part_measures(instrument, timeSignatures, keySignatures, grid):
+        yield create_measure(*measureArgs)
+
+
+def serialize_measure(measureArgs, stats=None):
+    """creates the measure of the arguments of create_measure and returns it serialized"""
+    with stage(stats, "emit"):
+        measure = create_measure(
+            *measureArgs, counts=stats.counts if stats is not None else None
+        )
+    with stage(stats, "serialize"):
+        return ET.tostring(measure, encoding="unicode")
+
+
+def measure_fingerprint(measureArgs):
+    """returns a digest of the arguments of create_measure, which are all a measure is written from"""
+    currentMeasure, lastMeasure, currentTime, *rest, entries = measureArgs
+    meter = (
+        None
+        if currentTime is None
+        else (currentTime.numerator, currentTime.denominator)
+    )
+    key = (currentMeasure, lastMeasure, meter)
+    digest = hashlib.blake2b(
+        repr(key + tuple(rest) + (len(entries[0]),)).encode("ascii"), digest_size=16
+    )
+    for column in entries:
+        digest.update(column.tobytes())
+    return digest.digest()
+
+
+class MeasureCache:
+    """Serialized measures of the last score written with it, by fingerprint.
+
+    Passed to write_score again after the song was edited, only the measures
+    whose fingerprint (see measure_fingerprint) changed are created and
+    serialized; every other measure is spliced in from the previous score.
+    Measures that are not used by a score are dropped once it is written.
+    """
+
+    def __init__(self):
+        self.fragments = {}
+        self.current = {}
+        # measures created and reused by the last score
+        self.rendered = 0
+        self.reused = 0
+
+    def render(self, measureArgs, stats=None):
+        """returns the serialized measure of the arguments of create_measure"""
+        with stage(stats, "fingerprint"):
+            fingerprint = measure_fingerprint(measureArgs)
+            fragment = self.current.get(fingerprint) or self.fragments.get(fingerprint)
+        if fragment is None:
+            fragment = serialize_measure(measureArgs, stats)
+            self.rendered += 1
+        else:
+            self.reused += 1
+            if stats is not None:
+                stats.count("measures_reused")
+        self.current[fingerprint] = fragment
+        return fragment
+
+    def start(self):
+        """starts a score, resetting the counts"""
+        self.rendered = 0
+        self.reused = 0
+        self.current = {}
+
+    def finish(self):
+        """keeps the measures of the score just written"""
+        self.fragments = self.current
+        self.current = {}
+
+
+def render_part(job):
+    """Renders one part to its serialized part element.
+
+    Args:
+    job : tuple
+        (part id, instrument, timeSignatures, keySignatures, grid, measure),
+        see create_measures; measure is True to collect stats
+
+    Returns:
+        (the part element as a string, the part's ConversionStats.as_dict() or None)
+    """
+    instId, *partArgs, measure = job
+    stats = ConversionStats() if measure else None
+    measures = [
+        serialize_measure(measureArgs, stats)
+        for measureArgs in part_measures(*partArgs, stats)
+    ]
+    part = f'<part id="{instId}">' + "".join(measures) + "</part>"
+    return part, stats.as_dict() if measure else None
+
+
+def score_layout(song, snap=1, stats=None):
+    """Works out the parts and measures of a song, before any measure is written.
+
+    Args:
+    song : PrettyMIDI
+        midi data to be written; its invalid notes are removed
+    snap : int
+        note positions are rounded to a multiple of this many divisions
+    stats : ConversionStats
+        collects the time spent and the number of parts, None to not measure
+
+    Returns:
+        a tuple (parts, timeSignatures, keySignatures, grid): the (id,
+        instrument) of each part in part list order, the song's time and key
+        signature changes (4/4 and C major if it has none) and its measures,
+        see measure_grid
     """
-    song = midi_object
-    root = ET.Element("score-partwise")
-    tree = ET.ElementTree(root)
-    partList = ET.SubElement(root, "part-list")
     # removes notes with a duration less than 0 (note.end is at the same time or before note.start)
-    song.remove_invalid_notes()
+    with stage(stats, "remove_invalid_notes"):
+        song.remove_invalid_notes()
     # numbers parts 'P1', 'P2', etc.
     instNum = 1
+    # (id, instrument) of each part, in part list order
+    parts = []
     for instrument in song.instruments:
         if instrument.is_drum is False:
-            instId = f"P{str(instNum)}"
-            partID = ET.SubElement(partList, "score-part", id=instId)
-            partName = ET.SubElement(partID, "part-name")
-            partName.text = instrument.name
+            parts.append((f"P{str(instNum)}", instrument))
             instNum += 1
-    # list containing the time stamp of each downbeat (1st beat in each measure)
-    downbeats = song.get_downbeats()
     # list containing time signature of piece, as well as time stamp when time signature changes
-    timeSignatures = song.time_signature_changes
+    timeSignatures = song.time_signature_changes or [pretty_midi.TimeSignature(4, 4, 0)]
     # list containing key signature of piece, as well as time stamp when key signature changes
-    keySignatures = song.key_signature_changes
+    keySignatures = song.key_signature_changes or [pretty_midi.KeySignature(0, 0)]
+    with stage(stats, "downbeats"):
+        # the division each measure starts and ends at, worked out from the song's ticks
+        resolution, scales = tempo_map(song)
+        starts = [
+            (
+                float(instrument.notes.start.max())
+                if isinstance(instrument.notes, NoteStore)
+                else max(note.start for note in instrument.notes)
+            )
+            for instrument in song.instruments
+            if len(instrument.notes)
+        ]
+        grid = measure_grid(
+            timeSignatures,
+            keySignatures,
+            song.get_end_time(),
+            resolution,
+            scales,
+            snap,
+            max(starts) if starts else None,
+        )
+    if stats is not None:
+        stats.count("parts", len(parts))
+    return parts, timeSignatures, keySignatures, grid
 
-    # same as before, resets before the for loop
-    instNum = 1
-    for instrument in song.instruments:
-        if instrument.is_drum is False:
-            # labels id in part element, matches id from above
-            instId = f"P{str(instNum)}"
-            # i keeps track of measures, based on prettymidi's downbeats list
-            i = 0
-            # j keeps track of time signature, based on prettymidi's time signature changes list
-            j = 0
-            # k keeps track of key signature, based on prettymidi's key signature changes list
-            k = 0
-            # create part
-            part = ET.SubElement(root, "part", id=instId)
-            # measure by measure loop
-            while i < len(downbeats):
-                currentMeasure = i + 1
-                # finds current time signature
-                while (
-                    j + 1 < len(timeSignatures)
-                    and downbeats[i] >= timeSignatures[j + 1].time
-                ):
-                    j += 1
-                currentTime = timeSignatures[j]
-                # finds current key signature
-                while (
-                    k + 1 < len(keySignatures)
-                    and downbeats[i] >= keySignatures[k + 1].time
+
+def part_list(parts):
+    """returns the serialized part-list element of the (id, instrument) of each part"""
+    partList = ET.Element("part-list")
+    for instId, instrument in parts:
+        partID = ET.SubElement(partList, "score-part", id=instId)
+        partName = ET.SubElement(partID, "part-name")
+        partName.text = instrument.name
+    return ET.tostring(partList, encoding="unicode")
+
+
+def write_score(file, song, part_workers=1, measure_cache=None, stats=None, snap=1):
+    """Writes a prettyMIDI object as a musicxml document to a text stream.
+
+    The header and part list are written first, then every measure is
+    written as soon as it is finished and dropped, so memory use does not
+    grow with the length of the score. With more than one part worker, parts
+    are rendered concurrently in worker processes instead and each is
+    written whole, in part list order, once it and the parts before it are
+    done; the output is the same.
+
+    Args:
+    file : file object
+        text stream the document is written to
+    song : PrettyMIDI
+        midi data to be written
+    part_workers : int
+        number of processes rendering parts, 1 to render them one after another
+    measure_cache : MeasureCache
+        measures of the previous score, reused where they have not changed;
+        parts are then rendered in this process whatever part_workers is
+    stats : ConversionStats
+        collects the time spent in each stage and counts of what is written
+        (stages of parts rendered by workers are summed over the workers)
+    snap : int
+        note positions are rounded to a multiple of this many divisions (24
+        per quarter note), 6 for sixteenth notes
+    """
+    parts, timeSignatures, keySignatures, grid = score_layout(song, snap, stats)
+
+    file.write("<?xml version='1.0' encoding='UTF8'?>\n<score-partwise>")
+    file.write(part_list(parts))
+    if part_workers > 1 and len(parts) > 1 and measure_cache is None:
+        jobs = [
+            (
+                instId,
+                instrument,
+                timeSignatures,
+                keySignatures,
+                grid,
+                stats is not None,
+            )
+            for instId, instrument in parts
+        ]
+        with ProcessPoolExecutor(min(part_workers, len(parts))) as executor:
+            # map yields parts in submission order, which is part list order
+            for part, partStats in executor.map(render_part, jobs):
+                with stage(stats, "write"):
+                    file.write(part)
+                if stats is not None:
+                    stats.merge(partStats)
+    else:
+        if measure_cache is not None:
+            measure_cache.start()
+        try:
+            for instId, instrument in parts:
+                # labels id in part element, matches id from above
+                file.write(f'<part id="{instId}">')
+                for measureArgs in part_measures(
+                    instrument, timeSignatures, keySignatures, grid, stats
                 ):
-                    k += 1
-                currentKey = pretty_midi.key_number_to_mode_accidentals(
-                    keySignatures[k].key_number
-                )
-                # finds length of measure in seconds
-                if currentMeasure == len(downbeats):
-                    measureLength = song.get_end_time() - downbeats[i]
-                else:
-                    measureLength = downbeats[i + 1] - downbeats[i]
-                # divisions per measure. Calculates the total number of divisions in the current measure (24 divisions per quarter note)
-                dpm = (
-                    (timeSignatures[j].numerator / timeSignatures[j].denominator)
-                    * 4
-                    * 24
-                )
-                # keeps track of divisions, which is used to know current position in the measure
-                numDivisions = 0
-                # true if there is a note present in this measure
-                isNote = False
-                # determines if treble or bass clef (only these 2 for simplicity; no changes throughout piece)
-                treble = 0
-                bass = 0
-                for note in instrument.notes:
-                    noteName = pretty_midi.note_number_to_name(note.pitch)
-                    if int(noteName[-1]) >= 4:
-                        treble += 1
+                    if measure_cache is not None:
+                        fragment = measure_cache.render(measureArgs, stats)
                     else:
-                        bass += 1
-                clef_type = "treble" if treble >= bass else "bass"
-                voiceNum = 1
-
-                # create measure
-                measure = ET.SubElement(part, "measure", number=str(currentMeasure))
-                measure.append(
-                    write_measure_attributes(
-                        currentMeasure, currentKey[1], currentTime, clef_type
-                    )
-                )
-                # if note is in measure, adds note element
-                for note in instrument.notes:
-                    # if note starts in current measure
-                    # (note starts on or after downbeat of this measure) and ((this is the last measure) or (note starts before downbeat of next measure))
-                    if round(
-                        ((note.start - downbeats[i]) / measureLength) * dpm
-                    ) >= 0 and (
-                        (
-                            currentMeasure == len(downbeats)
-                            or round(
-                                ((note.start - downbeats[i + 1]) / measureLength) * dpm
-                            )
-                            < 0
-                        )
-                    ):
-                        isNote = True
-                        if numDivisions < round(
-                            ((note.start - downbeats[i]) / measureLength) * dpm
-                        ):
-                            forward = ET.SubElement(measure, "forward")
-                            duration = ET.SubElement(forward, "duration")
-                            duration.text = str(
-                                round(
-                                    ((note.start - downbeats[i]) / measureLength) * dpm
-                                )
-                                - numDivisions
-                            )
-                            numDivisions = round(
-                                ((note.start - downbeats[i]) / measureLength) * dpm
-                            )
-                            voiceNum = 1
-                        elif numDivisions > round(
-                            ((note.start - downbeats[i]) / measureLength) * dpm
-                        ):
-                            backup = ET.SubElement(measure, "backup")
-                            duration = ET.SubElement(backup, "duration")
-                            duration.text = str(
-                                numDivisions
-                                - round(
-                                    ((note.start - downbeats[i]) / measureLength) * dpm
-                                )
-                            )
-                            numDivisions = round(
-                                ((note.start - downbeats[i]) / measureLength) * dpm
-                            )
-                            voiceNum += 1
-
-                        noteName = pretty_midi.note_number_to_name(note.pitch)
-                        # if note ends in current measure
-                        # (this is last measure) or (note ends before or on downbeat of next measure)
-                        if (
-                            currentMeasure == len(downbeats)
-                            or round(
-                                ((note.end - downbeats[i + 1]) / measureLength) * dpm
-                            )
-                            <= 0
-                        ):
-                            durationNum = round(
-                                ((note.end - note.start) / measureLength) * dpm
-                            )
-                            noteType = get_note_type(durationNum)
-                            notes = create_note(
-                                noteName, durationNum, noteType, True, True, voiceNum
-                            )
-                        else:
-                            durationNum = round(
-                                ((downbeats[i + 1] - note.start) / measureLength) * dpm
-                            )
-                            noteType = get_note_type(durationNum)
-                            notes = create_note(
-                                noteName, durationNum, noteType, True, False, voiceNum
-                            )
-                        for currentNote in notes:
-                            measure.append(currentNote)
-                        numDivisions += durationNum
-
-                    elif (
-                        round(((note.start - downbeats[i]) / measureLength) * dpm) < 0
-                        and round(((note.end - downbeats[i]) / measureLength) * dpm) > 0
-                    ):
-                        isNote = True
-                        if numDivisions != 0:
-                            backup = ET.SubElement(measure, "backup")
-                            duration = ET.SubElement(backup, "duration")
-                            duration.text = str(numDivisions)
-                            numDivisions = 0
-                            voiceNum += 1
-                        noteName = pretty_midi.note_number_to_name(note.pitch)
-
-                        # if note ends in current measure
-                        # (this is last measure) or (note ends on or before next downbeat)
-                        if (
-                            currentMeasure == len(downbeats)
-                            or round(
-                                ((note.end - downbeats[i + 1]) / measureLength) * dpm
-                            )
-                            <= 0
-                        ):
-                            durationNum = round(
-                                ((note.end - downbeats[i]) / measureLength) * dpm
-                            )
-                            noteType = get_note_type(durationNum)
-                            notes = create_note(
-                                noteName, durationNum, noteType, False, True, voiceNum
-                            )
-                            for currentNote in notes:
-                                measure.append(currentNote)
-                            numDivisions = round(
-                                ((note.end - downbeats[i]) / measureLength) * dpm
-                            )
-
-                        # if note continues into next measure
-                        else:
-                            durationNum = dpm
-                            noteType = get_note_type(durationNum)
-                            notes = create_note(
-                                noteName, durationNum, noteType, False, False, voiceNum
-                            )
-                            for currentNote in notes:
-                                measure.append(currentNote)
-                            numDivisions = dpm
-
-                # if there was no note in this measure, a rest is created
-                if isNote is False:
-                    currentNote = ET.SubElement(measure, "note")
-                    ET.SubElement(currentNote, "rest")
-                    duration = ET.SubElement(currentNote, "duration")
-                    duration.text = str(dpm)
-                    # note type
-                    if get_note_type(dpm) != "none":
-                        note_type = ET.SubElement(currentNote, "type")
-                        if get_note_type(dpm).find("double_dotted_") != -1:
-                            note_type.text = get_note_type(dpm)[14:]
-                            ET.SubElement(currentNote, "dot")
-                            ET.SubElement(currentNote, "dot")
-                        elif get_note_type(dpm).find("dotted_") != -1:
-                            note_type.text = get_note_type(dpm)[7:]
-                            ET.SubElement(currentNote, "dot")
-                        else:
-                            note_type.text = get_note_type(dpm)
-
-                i += 1
-            instNum += 1
+                        fragment = serialize_measure(measureArgs, stats)
+                    with stage(stats, "write"):
+                        file.write(fragment)
+                file.write("</part>")
+        finally:
+            if measure_cache is not None:
+                measure_cache.finish()
+    file.write("</score-partwise>")
+
+
+class ScoreIndex:
+    """A song's notes quantized into its measures, to render windows of measures from.
+
+    The parts, measures and quantized notes of the song are worked out once,
+    when the index is built; rendering a window then only creates the
+    measures in it, so its cost depends on the size of the window rather
+    than the length of the song. Notes carried over the edges of a window
+    are written with their tie stops and starts, as in the whole score.
+
+    Args:
+    song : PrettyMIDI
+        midi data to be written; its invalid notes are removed
+    snap : int
+        note positions are rounded to a multiple of this many divisions, see write_score
+    stats : ConversionStats
+        collects the time spent building the index, None to not measure
+    """
+
+    def __init__(self, song, snap=1, stats=None):
+        self.parts, timeSignatures, keySignatures, self.grid = score_layout(
+            song, snap, stats
+        )
+        self.times, self.keys = measure_signatures(
+            timeSignatures, keySignatures, self.grid
+        )
+        # quantized notes of each part, by part id
+        self.notes = {
+            instId: quantize_part(instrument, self.grid, stats)
+            for instId, instrument in self.parts
+        }
+
+    def __len__(self):
+        """returns the number of measures of the song"""
+        return len(self.times)
+
+    def render(self, first, last, parts=None, as_bytes=False, stats=None):
+        """Renders a window of measures as a musicxml document.
+
+        Args:
+        first, last : int
+            numbers (from 1) of the first and last measure of the window;
+            last is cut down to the last measure of the song
+        parts : list
+            ids ('P1', 'P2', etc.) of the parts to render, None for all of them
+        as_bytes : bool
+            return the document as utf-8 bytes instead of a string
+        stats : ConversionStats
+            collects the time spent in each stage and counts of what is written
+
+        Returns:
+            the document, holding only the window's measures, numbered as in
+            the whole score, each part starting with its attributes
+        """
+        last = min(last, len(self))
+        if not 1 <= first <= last:
+            raise ValueError(
+                f"measures {first} to {last} are not in a song of {len(self)}"
+            )
+        if parts is None:
+            parts = [instId for instId, _ in self.parts]
+        unknown = set(parts) - set(self.notes)
+        if unknown:
+            raise ValueError(f"no parts {sorted(unknown)} in the song")
+        chosen = [(instId, inst) for instId, inst in self.parts if instId in parts]
+        fragments = ["<?xml version='1.0' encoding='UTF8'?>\n<score-partwise>"]
+        fragments.append(part_list(chosen))
+        for instId, _ in chosen:
+            fragments.append(f'<part id="{instId}">')
+            for measureArgs in measure_arguments(
+                self.notes[instId], self.times, self.keys, self.grid, first - 1, last
+            ):
+                fragments.append(serialize_measure(measureArgs, stats))
+            fragments.append("</part>")
+        fragments.append("</score-partwise>")
+        score = "".join(fragments)
+        return score.encode("utf-8") if as_bytes else score
+
+
+@contextmanager
+def open_score(filename, compresslevel=None):
+    """Opens a text file a score is written to.
+
+    Filenames ending in .mxl are written as compressed musicxml: a zip
+    archive holding META-INF/container.xml and the score, which is deflated
+    while it is written.
+
+    Args:
+    filename : str
+        path of the .xml, .musicxml or .mxl file
+    compresslevel : int
+        zlib compression level (0-9) of .mxl files, None for zlib's default
+    """
+    if filename.endswith(".mxl"):
+        scoreName = os.path.basename(filename)[: -len(".mxl")] + ".xml"
+        with zipfile.ZipFile(
+            filename, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel
+        ) as archive:
+            # the mimetype entry comes first and is stored uncompressed
+            archive.writestr(zipfile.ZipInfo("mimetype"), MXL_MIMETYPE)
+            archive.writestr(
+                "META-INF/container.xml", MXL_CONTAINER.format(quoteattr(scoreName))
+            )
+            with io.TextIOWrapper(
+                archive.open(scoreName, "w"),
+                encoding="UTF8",
+                errors="xmlcharrefreplace",
+            ) as file:
+                yield file
+    else:
+        with open(filename, "w", encoding="UTF8", errors="xmlcharrefreplace") as file:
+            yield file
+
+
+def write_to_xml(
+    midi_object,
+    filename,
+    compresslevel=None,
+    part_workers=1,
+    measure_cache=None,
+    stats=None,
+    snap=1,
+):
+    """writes a prettyMIDI object to a musicxml file.
+
+    Args:
+    midi_object : PrettyMIDI
+        midi data to be written
+    filename : str
+        path to write xml file to, .mxl for compressed musicxml (see open_score)
+    compresslevel : int
+        zlib compression level (0-9) of .mxl files, None for zlib's default
+    part_workers : int
+        number of processes rendering parts concurrently, see write_score
+    measure_cache : MeasureCache
+        measures of the previous score, see write_score
+    stats : ConversionStats
+        collects the time spent in each stage and counts of what is written,
+        including the size of the file (output_bytes)
+    snap : int
+        divisions note positions are rounded to a multiple of, see write_score
+
+    Returns:
+        stats, once its callback has been called
+    """
     if (
         filename.find(".xml") == -1
         and filename.find(".mxl") == -1
         and filename.find(".musicxml") == -1
     ):
         filename += ".xml"
-    tree.write(filename, "UTF8")
+    with open_score(filename, compresslevel) as file:
+        write_score(file, midi_object, part_workers, measure_cache, stats, snap)
+    if stats is not None:
+        stats.count("output_bytes", os.path.getsize(filename))
+        stats.finish()
+    return stats
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+# midi2xml - convert files, globs or directories of midi files to musicxml in parallel
+
+import argparse
+import glob
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from cache import ConversionCache
+from main import open_score, write_score, write_to_xml
+from smf import read_midi
+
+MIDI_EXTENSIONS = (".mid", ".midi")
+
+# cache shared by the jobs of a worker process, see open_cache
+CACHE = None
+
+
+def collect_inputs(patterns):
+    """Expands files, globs and directories into a sorted list of midi files.
+
+    Args:
+    patterns : list
+        paths of midi files, glob patterns, or directories (searched recursively)
+
+    Returns:
+        a sorted list of unique midi file paths
+    """
+    inputs = set()
+    for pattern in patterns:
+        paths = (
+            glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        )
+        for path in paths:
+            if os.path.isdir(path):
+                for dirpath, _, filenames in os.walk(path):
+                    for filename in filenames:
+                        if filename.lower().endswith(MIDI_EXTENSIONS):
+                            inputs.add(os.path.join(dirpath, filename))
+            elif os.path.isfile(path):
+                inputs.add(path)
+    return sorted(inputs)
+
+
+def output_path(input_path, output_dir=None, extension=".xml", root=None):
+    """Returns the path a midi file is converted to.
+
+    Args:
+    input_path : str
+        path of the midi file
+    output_dir : str
+        directory outputs are written to, None to write next to the input
+    extension : str
+        extension of the output
+    root : str
+        directory the input's path is kept relative to under output_dir, None
+        to write straight into output_dir
+
+    Returns:
+        the output path
+    """
+    name = os.path.splitext(os.path.basename(input_path))[0] + extension
+    if not output_dir:
+        return os.path.join(os.path.dirname(input_path), name)
+    if root is not None:
+        relative = os.path.relpath(os.path.dirname(os.path.abspath(input_path)), root)
+        output_dir = os.path.normpath(os.path.join(output_dir, relative))
+    return os.path.join(output_dir, name)
+
+
+def is_up_to_date(input_path, output):
+    """returns True if output exists and is not older than input_path"""
+    try:
+        return os.path.getmtime(output) >= os.path.getmtime(input_path)
+    except OSError:
+        return False
+
+
+def read_manifest(manifest):
+    """Reads the last record of each input from a manifest file.
+
+    Args:
+    manifest : str
+        path to a manifest written by convert_batch (one json record per line)
+
+    Returns:
+        a dict mapping input paths to their most recent record
+    """
+    records = {}
+    if os.path.exists(manifest):
+        with open(manifest) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interrupted batch
+                    continue
+                records[record["input"]] = record
+    return records
+
+
+def open_cache(directory, max_bytes):
+    """opens the conversion cache of a worker process"""
+    global CACHE
+    CACHE = ConversionCache(directory, max_bytes) if directory else None
+
+
+def render_score(data):
+    """returns the score of midi file bytes, encoded as written to .xml files"""
+    score = io.StringIO()
+    write_score(score, read_midi(data))
+    return score.getvalue().encode("UTF8", "xmlcharrefreplace")
+
+
+def convert_file(job):
+    """Converts one midi file, writing to a temporary file that replaces the output once complete.
+
+    With a cache open (see open_cache), the score is looked up by the bytes
+    of the input before it is rendered.
+
+    Args:
+    job : tuple
+        (input path, output path, compresslevel)
+
+    Returns:
+        a manifest record (dict) describing the result
+    """
+    input_path, output, compresslevel = job
+    started = time.perf_counter()
+    record = {
+        "input": input_path,
+        "output": output,
+        "mtime": os.path.getmtime(input_path),
+    }
+    outputDir = os.path.dirname(output) or "."
+    try:
+        os.makedirs(outputDir, exist_ok=True)
+        # written under its real name (.mxl archives name the score after the file)
+        # in a directory of its own, then moved into place
+        with tempfile.TemporaryDirectory(dir=outputDir, prefix=".midi2xml-") as partial:
+            partialOutput = os.path.join(partial, os.path.basename(output))
+            if CACHE is None:
+                write_to_xml(
+                    read_midi(input_path),
+                    partialOutput,
+                    compresslevel=compresslevel,
+                )
+            else:
+                with open(input_path, "rb") as file:
+                    data = file.read()
+                key = CACHE.key(data)
+                score = CACHE.get(key)
+                record["cache"] = "miss" if score is None else "hit"
+                if score is None:
+                    score = render_score(data)
+                    CACHE.put(key, score)
+                with open_score(partialOutput, compresslevel) as file:
+                    file.write(score.decode("UTF8"))
+            os.replace(partialOutput, output)
+        record["status"] = "converted"
+    except Exception as error:
+        record["status"] = "failed"
+        record["error"] = f"{type(error).__name__}: {error}"
+    record["seconds"] = round(time.perf_counter() - started, 4)
+    return record
+
+
+def convert_batch(
+    inputs,
+    output_dir=None,
+    extension=".xml",
+    compresslevel=None,
+    manifest=None,
+    workers=None,
+    force=False,
+    retry_failed=False,
+    progress=None,
+    cache_dir=None,
+    cache_size=1024**3,
+):
+    """Converts midi files to musicxml on a process pool, skipping outputs that are already up to date.
+
+    With an output directory, each output keeps its input's path relative to
+    the directory all inputs share. Inputs that would still be written to the
+    same output (song.mid and song.midi) fail instead of overwriting each
+    other.
+
+    Every result is appended to the manifest as soon as it is known, so an
+    interrupted batch resumes where it stopped when it is run again. Inputs
+    that failed and have not changed since are skipped unless retry_failed
+    is set.
+
+    Args:
+    inputs : list
+        paths of midi files to convert
+    output_dir : str
+        directory outputs are written to, None to write next to each input
+    extension : str
+        extension of the outputs (.xml, .musicxml or .mxl)
+    compresslevel : int
+        compression level of .mxl outputs
+    manifest : str
+        path of the manifest (one json record per line), None to not keep one
+    workers : int
+        number of worker processes, None for one per available core
+    force : bool
+        convert inputs even if their output is up to date
+    retry_failed : bool
+        convert inputs the manifest records as failed even if they have not changed
+    progress : callable
+        called with (number done, total, record) after each input
+    cache_dir : str
+        directory of a conversion cache (see cache.ConversionCache) shared by
+        the workers, None to not use one
+    cache_size : int
+        bytes the cache is kept under
+
+    Returns:
+        a dict counting inputs per status (converted, skipped, failed), and
+        with a cache, the number of conversions it answered (cached)
+    """
+    previous = read_manifest(manifest) if manifest else {}
+    counts = {"converted": 0, "skipped": 0, "failed": 0}
+    if cache_dir:
+        counts["cached"] = 0
+    jobs = []
+    skipped = []
+    collisions = []
+    root = None
+    if output_dir and inputs:
+        root = os.path.commonpath(
+            [os.path.dirname(os.path.abspath(path)) for path in inputs]
+        )
+    # input each output is written from
+    outputs = {}
+    for input_path in inputs:
+        output = output_path(input_path, output_dir, extension, root)
+        last = previous.get(input_path)
+        if output in outputs:
+            collisions.append(
+                {
+                    "input": input_path,
+                    "output": output,
+                    "status": "failed",
+                    "error": f"output is also written from {outputs[output]}",
+                }
+            )
+            continue
+        outputs[output] = input_path
+        if not force and is_up_to_date(input_path, output):
+            skipped.append({"input": input_path, "output": output, "status": "skipped"})
+        elif (
+            not force
+            and not retry_failed
+            and last is not None
+            and last["status"] == "failed"
+            and last.get("mtime") == os.path.getmtime(input_path)
+        ):
+            skipped.append({"input": input_path, "output": output, "status": "skipped"})
+        else:
+            jobs.append((input_path, output, compresslevel))
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if workers is None:
+        workers = (
+            len(os.sched_getaffinity(0))
+            if hasattr(os, "sched_getaffinity")
+            else os.cpu_count()
+        )
+    workers = max(1, min(workers, len(jobs)))
+    total = len(inputs)
+    done = 0
+    manifestFile = open(manifest, "a") if manifest else None
+    try:
+        for record in skipped + collisions:
+            done += 1
+            counts[record["status"]] += 1
+            if manifestFile and record["status"] == "failed":
+                manifestFile.write(json.dumps(record) + "\n")
+            if progress:
+                progress(done, total, record)
+        if jobs:
+            # several jobs per task keep the pool's overhead low on large batches
+            chunksize = max(1, min(16, len(jobs) // (workers * 8)))
+            with multiprocessing.Pool(
+                workers, open_cache, (cache_dir, cache_size)
+            ) as pool:
+                for record in pool.imap_unordered(convert_file, jobs, chunksize):
+                    done += 1
+                    counts[record["status"]] += 1
+                    if record.get("cache") == "hit":
+                        counts["cached"] += 1
+                    if manifestFile:
+                        manifestFile.write(json.dumps(record) + "\n")
+                        manifestFile.flush()
+                    if progress:
+                        progress(done, total, record)
+    finally:
+        if manifestFile:
+            manifestFile.close()
+    return counts
+
+
+def print_progress(done, total, record):
+    line = f"[{done}/{total}] {record['status']} {record['input']}"
+    if record.get("cache") == "hit":
+        line += " (cached)"
+    if record["status"] == "failed":
+        line += f" ({record['error']})"
+    print(line, file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="midi2xml - convert midi files to musicxml"
+    )
+    parser.add_argument(
+        "inputs", type=str, nargs="+", help="Midi files, glob patterns or directories"
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=str,
+        help="Output directory (default: next to each input)",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default="xml",
+        choices=["xml", "musicxml", "mxl"],
+        help="Output format (default xml)",
+    )
+    parser.add_argument(
+        "-c", "--compresslevel", type=int, help="Compression level (0-9) of mxl outputs"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of worker processes (default: available cores)",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        help="Manifest file recording the result of each input",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Convert inputs even if their output is up to date",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Retry inputs the manifest records as failed",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="Directory of a cache of converted scores, reused across batches",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="Size the cache is kept under, in MB (default 1024)",
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="Only print the summary"
+    )
+
+    args = parser.parse_args(argv)
+
+    inputs = collect_inputs(args.inputs)
+    counts = convert_batch(
+        inputs,
+        output_dir=args.output_dir,
+        extension="." + args.format,
+        compresslevel=args.compresslevel,
+        manifest=args.manifest,
+        workers=args.jobs,
+        force=args.force,
+        retry_failed=args.retry_failed,
+        progress=None if args.quiet else print_progress,
+        cache_dir=args.cache,
+        cache_size=args.cache_size * 1024**2,
+    )
+    summary = f"midi2xml: {counts['converted']} converted, {counts['skipped']} skipped, {counts['failed']} failed"
+    if args.cache:
+        summary += f" ({counts['cached']} from cache)"
+    print(summary, file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+# midi2xml server - keeps converters loaded in a pool of worker processes and
+# serves conversions over localhost http or a unix socket
+
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+from cache import ConversionCache
+from ezchord import chord_progression_to_xml
+from main import read_from_xml, write_score, write_to_xml
+from smf import read_midi
+
+# largest request body accepted, in bytes
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def midi_to_xml(data, options):
+    """Converts midi file bytes to musicxml bytes (.mxl archive bytes if options["format"] is "mxl")."""
+    song = read_midi(data)
+    if options.get("format") == "mxl":
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "score.mxl")
+            compresslevel = options.get("compresslevel")
+            write_to_xml(
+                song, path, int(compresslevel) if compresslevel is not None else None
+            )
+            with open(path, "rb") as file:
+                return file.read()
+    score = io.StringIO()
+    write_score(score, song)
+    return score.getvalue().encode("UTF8", "xmlcharrefreplace")
+
+
+def xml_to_midi(data, options):
+    """Converts musicxml or .mxl bytes to midi file bytes."""
+    midi = io.BytesIO()
+    read_from_xml(io.BytesIO(data)).write(midi)
+    return midi.getvalue()
+
+
+def chords_to_xml(data, options):
+    """Renders a chord progression, utf-8 text of names separated by commas or whitespace, to musicxml bytes."""
+    text = data.decode("utf-8")
+    progression = text.split(",") if "," in text else text.split()
+    return chord_progression_to_xml(
+        progression,
+        options.get("key", "c"),
+        int(options.get("octave", 4)),
+        float(options.get("duration", 1)),
+        options.get("voice", "0").lower() in ("1", "true", "yes"),
+    )
+
+
+# conversion run for each request path, with the content type of its result
+JOBS = {
+    "/midi2xml": (midi_to_xml, "application/vnd.recordare.musicxml+xml"),
+    "/xml2midi": (xml_to_midi, "audio/midi"),
+    "/chords2xml": (chords_to_xml, "application/vnd.recordare.musicxml+xml"),
+}
+
+# errors a conversion raises for input it cannot read, answered with 400; anything else is a 500
+INPUT_ERRORS = (
+    ValueError,
+    KeyError,
+    IndexError,
+    EOFError,
+    OSError,
+    ET.ParseError,
+    zipfile.BadZipFile,
+)
+
+# one measure score converted by each new worker
+WARM_UP_SCORE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<score-partwise><part-list><score-part id="P1"><part-name/></score-part></part-list>
+<part id="P1"><measure number="1"><attributes><divisions>1</divisions>
+<key><fifths>0</fifths></key><time><beats>4</beats><beat-type>4</beat-type></time></attributes>
+<note><pitch><step>C</step><octave>4</octave></pitch><duration>4</duration></note>
+</measure></part></score-partwise>
+"""
+
+
+def warm_up():
+    """Runs every converter once in a new worker, so its first request does not pay for loading."""
+    midi = xml_to_midi(WARM_UP_SCORE, {})
+    midi_to_xml(midi, {})
+    midi_to_xml(midi, {"format": "mxl"})
+    chords_to_xml(b"C Am F G", {"voice": "1"})
+
+
+class ConversionServer:
+    """Serves conversions from a pool of warm worker processes.
+
+    At most `workers` conversions run at once; up to `max_pending` more wait
+    for a free worker, and requests beyond that are refused with 503 so a
+    burst cannot queue unbounded work.
+
+    Args:
+    workers : int
+        number of worker processes, None for one per core
+    max_pending : int
+        number of requests allowed to wait for a worker
+    cache : ConversionCache
+        cache answering repeated conversions without a worker, None to not use one
+    """
+
+    def __init__(self, workers=None, max_pending=64, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.cache = cache
+        self.pool = None
+        self.running = 0
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start_pool(self):
+        """Starts the worker processes and waits until every one has warmed up."""
+        self.pool = self.create_pool()
+        # workers are otherwise only started as jobs arrive
+        for started in [self.pool.submit(os.getpid) for _ in range(self.workers)]:
+            started.result()
+        self.slots = asyncio.Semaphore(self.workers)
+
+    def create_pool(self):
+        # workers started from a fork server do not inherit the sockets of open connections
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else None
+        )
+        return ProcessPoolExecutor(
+            self.workers, mp_context=context, initializer=warm_up
+        )
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def stats(self):
+        stats = {
+            "workers": self.workers,
+            "running": self.running,
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+    async def convert(self, path, data, options):
+        """Runs one conversion on the pool, returning (status, content type, body)."""
+        job, contentType = JOBS[path]
+        loop = asyncio.get_running_loop()
+        if self.cache is not None:
+            # hashing and reading large bodies is kept off the event loop
+            key = await loop.run_in_executor(
+                None, self.cache.key, data, {"path": path, **options}
+            )
+            result = await loop.run_in_executor(None, self.cache.get, key)
+            if result is not None:
+                self.completed += 1
+                return 200, contentType, result
+        if self.pending >= self.max_pending and self.slots.locked():
+            self.rejected += 1
+            return 503, "text/plain", b"too many pending conversions\n"
+        self.pending += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.pending -= 1
+        self.running += 1
+        pool = self.pool
+        try:
+            result = await loop.run_in_executor(pool, job, data, options)
+        except INPUT_ERRORS as error:
+            self.failed += 1
+            message = f"{type(error).__name__}: {error}\n"
+            return 400, "text/plain", message.encode("utf-8")
+        except BrokenProcessPool:
+            self.failed += 1
+            # a worker died; later requests get a new pool
+            if self.pool is pool:
+                pool.shutdown(wait=False)
+                self.pool = self.create_pool()
+            return 500, "text/plain", b"conversion worker failed\n"
+        except Exception as error:
+            self.failed += 1
+            message = f"{type(error).__name__}: {error}\n"
+            return 500, "text/plain", message.encode("utf-8")
+        finally:
+            self.running -= 1
+            self.slots.release()
+        if self.cache is not None:
+            await loop.run_in_executor(None, self.cache.put, key, result)
+        self.completed += 1
+        return 200, contentType, result
+
+    async def respond(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, "application/json", json.dumps(self.stats()).encode("utf-8")
+        if url.path not in JOBS:
+            return 404, "text/plain", b"unknown conversion\n"
+        if method != "POST":
+            return 405, "text/plain", b"conversions are POST requests\n"
+        options = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        return await self.convert(url.path, body, options)
+
+    async def handle(self, reader, writer):
+        """Serves the http/1.1 requests of one connection, keeping it open between requests."""
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                try:
+                    method, target, _ = requestLine.decode("latin-1").split()
+                except ValueError:
+                    await self.send(writer, 400, "text/plain", b"bad request line\n")
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.send(writer, 400, "text/plain", b"bad content-length\n")
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self.send(writer, 413, "text/plain", b"body too large\n")
+                    break
+                body = await reader.readexactly(length)
+                status, contentType, result = await self.respond(method, target, body)
+                await self.send(writer, status, contentType, result)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, contentType, body):
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                f"Content-Type: {contentType}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            ).encode("latin-1")
+            + body
+        )
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8765, socket_path=None):
+        """Starts the pool and serves until cancelled, on a unix socket if socket_path is given."""
+        self.start_pool()
+        try:
+            if socket_path:
+                server = await asyncio.start_unix_server(self.handle, socket_path)
+            else:
+                server = await asyncio.start_server(self.handle, host, port)
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="midi2xml server - serve conversions from warm worker processes"
+    )
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="Address (default 127.0.0.1)"
+    )
+    parser.add_argument(
+        "-p", "--port", type=int, default=8765, help="Port (default 8765)"
+    )
+    parser.add_argument(
+        "-s", "--socket", type=str, help="Serve on this unix socket instead"
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, help="Worker processes (default: one per core)"
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=64,
+        help="Requests allowed to wait for a worker (default 64)",
+    )
+    parser.add_argument(
+        "--cache", type=str, help="Directory of a cache of conversion results"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="Size the cache is kept under, in MB (default 1024)",
+    )
+
+    args = parser.parse_args(argv)
+
+    cache = (
+        ConversionCache(args.cache, args.cache_size * 1024**2) if args.cache else None
+    )
+    server = ConversionServer(args.workers, args.max_pending, cache)
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"midi2xml server: listening on {where}", file=sys.stderr)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
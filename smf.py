@@ -0,0 +1,391 @@
+# standard midi file reader - reads .mid files straight into the typed note
+# arrays the converter works on, without building a mido or pretty_midi Note
+# object per event
+
+import mmap
+import os
+import warnings
+
+import numpy as np
+import pretty_midi
+
+from main import NoteStore, tempo_segments
+
+# data bytes following each channel message status, by status >> 4
+DATA_LENGTHS = {0x8: 2, 0x9: 2, 0xA: 2, 0xB: 2, 0xC: 1, 0xD: 1, 0xE: 2}
+# data bytes following each system common status, which only appear in malformed files
+SYSTEM_LENGTHS = {0xF1: 1, 0xF2: 2, 0xF3: 1}
+
+# meta event types read
+META_TEXT = 0x01
+META_TRACK_NAME = 0x03
+META_LYRICS = 0x05
+META_TEMPO = 0x51
+META_TIME_SIGNATURE = 0x58
+META_KEY_SIGNATURE = 0x59
+
+# midi channel of drums
+DRUM_CHANNEL = 9
+
+
+class ArrayInstrument(pretty_midi.Instrument):
+    """A pretty_midi Instrument whose notes are a NoteStore instead of a list of Notes.
+
+    write_score and part_measures use the arrays as they are, and the rest
+    of pretty_midi reads them as Notes (see NoteStore). The notes are read
+    only: to edit them, replace them with a list first, such as
+    instrument.notes = list(instrument.notes). Control changes and pitch
+    bends are not kept; only the time of the last one is, as it counts
+    towards the end of the song.
+
+    Args:
+    program : int
+        midi program of the instrument
+    is_drum : bool
+        True for an instrument on the drum channel
+    name : str
+        name of the track the instrument was read from
+    notes : NoteStore
+        notes of the instrument
+    control_end : float
+        time of the instrument's last control change or pitch bend, None if it has none
+    """
+
+    def __init__(self, program, is_drum, name, notes, control_end=None):
+        super().__init__(program, is_drum, name)
+        self.notes = notes
+        self.control_end = control_end
+
+    def get_end_time(self):
+        times = [self.notes.end.max()] if len(self.notes) else []
+        if self.control_end is not None:
+            times.append(self.control_end)
+        return float(max(times)) if times else 0.0
+
+    def remove_invalid_notes(self):
+        valid = self.notes.end > self.notes.start
+        if not valid.all():
+            notes = self.notes
+            self.notes = NoteStore.from_arrays(
+                notes.pitch[valid],
+                notes.velocity[valid],
+                notes.start[valid],
+                notes.end[valid],
+                notes.start_tick[valid],
+                notes.end_tick[valid],
+            )
+
+
+class PartNotes:
+    """Notes of one instrument as they are read, in the order pretty_midi would list them."""
+
+    def __init__(self, program, channel, name, controls):
+        self.program = program
+        self.channel = channel
+        self.name = name
+        self.pitch = []
+        self.velocity = []
+        self.start = []
+        self.end = []
+        # [tick of the last control change or pitch bend], shared with the
+        # track's stragglers as pretty_midi shares their event lists
+        self.controls = controls
+
+
+def read_vlq(data, pos):
+    """returns (value, position after it) of the variable-length quantity at pos"""
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def read_track(data, pos, end, track, parts, stragglers, meta):
+    """Reads the events of one track chunk.
+
+    Notes are paired and instruments told apart as pretty_midi does: by
+    (program, channel, track), a note-off closing every note of its pitch
+    and channel opened at an earlier tick.
+
+    Args:
+    data : bytes-like
+        the file
+    pos, end : int
+        offsets of the chunk's first event and of the chunk's end
+    track : int
+        index of the track
+    parts : dict
+        PartNotes by (program, channel, track), filled in creation order
+    stragglers : dict
+        [last control tick] of control events met before a note by (channel, track)
+    meta : dict
+        lists of (tick, values) tempo, time signature, key signature, text and
+        lyrics events, and "misplaced", True once signature or tempo events are met off track 0
+    """
+    tick = 0
+    status = 0
+    trackName = ""
+    programs = [0] * 16
+    # (tick, velocity) of the open notes of each (channel, pitch)
+    openNotes = {}
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        if byte < 0x80:
+            tick += byte
+        else:
+            delta, pos = read_vlq(data, pos - 1)
+            tick += delta
+        byte = data[pos]
+        if byte == 0xFF:
+            # meta events neither take part in nor end running status
+            metaType = data[pos + 1]
+            length, pos = read_vlq(data, pos + 2)
+            body = data[pos : pos + length]
+            pos += length
+            if metaType == META_TRACK_NAME:
+                trackName = bytes(body).decode("latin-1")
+            elif metaType == META_TEXT or metaType == META_LYRICS:
+                meta["text" if metaType == META_TEXT else "lyrics"].append(
+                    (tick, bytes(body).decode("latin-1"))
+                )
+            elif metaType in (META_TEMPO, META_TIME_SIGNATURE, META_KEY_SIGNATURE):
+                if track != 0:
+                    meta["misplaced"] = True
+                elif metaType == META_TEMPO:
+                    meta["tempo"].append(
+                        (tick, (body[0] << 16) | (body[1] << 8) | body[2])
+                    )
+                elif metaType == META_TIME_SIGNATURE:
+                    meta["time_signature"].append((tick, (body[0], 2 ** body[1])))
+                else:
+                    sharps = body[0] - 256 if body[0] > 127 else body[0]
+                    meta["key_signature"].append((tick, (sharps, body[1])))
+            continue
+        if byte >= 0x80:
+            status = byte
+            pos += 1
+        elif status == 0:
+            raise ValueError(f"running status without a status byte at offset {pos}")
+        kind = status >> 4
+        if kind == 0x9 or kind == 0x8:
+            pitch = data[pos]
+            velocity = data[pos + 1]
+            pos += 2
+            channel = status & 0x0F
+            key = (channel, pitch)
+            if kind == 0x9 and velocity > 0:
+                notes = openNotes.get(key)
+                if notes is None:
+                    openNotes[key] = [(tick, velocity)]
+                else:
+                    notes.append((tick, velocity))
+                continue
+            notes = openNotes.get(key)
+            if notes is None:
+                # spurious note-off
+                continue
+            # a note-on at the same tick stays open, as it starts a new note
+            kept = [note for note in notes if note[0] == tick]
+            closed = [note for note in notes if note[0] != tick]
+            if closed:
+                program = programs[channel]
+                part = parts.get((program, channel, track))
+                if part is None:
+                    controls = stragglers.get((channel, track), [-1])
+                    part = parts[(program, channel, track)] = PartNotes(
+                        program, channel, trackName, controls
+                    )
+                for start, velocity in closed:
+                    part.pitch.append(pitch)
+                    part.velocity.append(velocity)
+                    part.start.append(start)
+                    part.end.append(tick)
+            if closed and kept:
+                openNotes[key] = kept
+            else:
+                del openNotes[key]
+        elif kind == 0xC:
+            programs[status & 0x0F] = data[pos]
+            pos += 1
+        elif kind == 0xB or kind == 0xE:
+            pos += 2
+            channel = status & 0x0F
+            part = parts.get((programs[channel], channel, track))
+            if part is not None:
+                controls = part.controls
+            else:
+                controls = stragglers.setdefault((channel, track), [-1])
+            controls[0] = tick
+        elif kind < 0xF:
+            pos += DATA_LENGTHS[kind]
+        elif status == 0xF0 or status == 0xF7:
+            length, pos = read_vlq(data, pos)
+            pos += length
+            status = 0
+        else:
+            pos += SYSTEM_LENGTHS.get(status, 0)
+            status = 0
+    if pos > end:
+        raise EOFError(f"track {track} ends in the middle of an event")
+
+
+def tick_scales(resolution, tempos):
+    """returns pretty_midi's (tick, seconds per tick) tempo list of the track 0 tempo events"""
+    scales = [(0, 60.0 / (120.0 * resolution))]
+    for tick, tempo in tempos:
+        scale = 60.0 / ((6e7 / tempo) * resolution)
+        if tick == 0:
+            scales = [(0, scale)]
+        elif scale != scales[-1][1]:
+            scales.append((tick, scale))
+    return scales
+
+
+def ticks_to_seconds(ticks, scales):
+    """Converts ticks to seconds, computing exactly what pretty_midi's tick_to_time array holds.
+
+    Args:
+    ticks : np.ndarray
+        ticks to convert
+    scales : list
+        (tick, seconds per tick) of each tempo, see tick_scales
+
+    Returns:
+        an array of the times of ticks in seconds
+    """
+    scaleTicks, perTick, startTimes = tempo_segments(scales)
+    segments = np.searchsorted(scaleTicks, ticks, side="right") - 1
+    return startTimes[segments] + perTick[segments] * (ticks - scaleTicks[segments])
+
+
+def parse_midi(data):
+    """Reads a standard midi file from a bytes-like object, see read_midi."""
+    if bytes(data[:4]) != b"MThd":
+        raise ValueError("not a standard midi file")
+    headerLength = int.from_bytes(data[4:8], "big")
+    if headerLength < 6 or len(data) < 8 + headerLength:
+        raise EOFError("standard midi file header is cut short")
+    trackCount = int.from_bytes(data[10:12], "big")
+    resolution = int.from_bytes(data[12:14], "big")
+    if resolution & 0x8000:
+        raise ValueError("smpte time division is not supported")
+    parts = {}
+    stragglers = {}
+    meta = {
+        "tempo": [],
+        "time_signature": [],
+        "key_signature": [],
+        "text": [],
+        "lyrics": [],
+        "misplaced": False,
+    }
+    pos = 8 + headerLength
+    track = 0
+    while track < trackCount and pos + 8 <= len(data):
+        chunkType = bytes(data[pos : pos + 4])
+        length = int.from_bytes(data[pos + 4 : pos + 8], "big")
+        pos += 8
+        if pos + length > len(data):
+            raise EOFError(f"track {track} is cut short")
+        if chunkType == b"MTrk":
+            read_track(data, pos, pos + length, track, parts, stragglers, meta)
+            track += 1
+        pos += length
+    if track == 0:
+        raise ValueError("standard midi file has no tracks")
+    if meta["misplaced"]:
+        warnings.warn(
+            "Tempo, Key or Time signature change events found on non-zero tracks. "
+            "This is not a valid type 0 or type 1 MIDI file. Tempo, Key or Time "
+            "Signature may be wrong.",
+            RuntimeWarning,
+        )
+
+    song = pretty_midi.PrettyMIDI(resolution=resolution)
+    # pretty_midi keeps its tempo map in _tick_scales; setting it lets the
+    # song work out beats, downbeats and its end time itself
+    song._tick_scales = tick_scales(resolution, meta["tempo"])
+    song._update_tick_to_time(0)
+
+    def seconds(ticks):
+        return ticks_to_seconds(np.asarray(ticks, dtype=np.int64), song._tick_scales)
+
+    for name in ("time_signature", "key_signature", "text", "lyrics"):
+        meta[name + "_times"] = seconds([tick for tick, _ in meta[name]]).tolist()
+    song.time_signature_changes = [
+        pretty_midi.TimeSignature(numerator, denominator, time)
+        for (_, (numerator, denominator)), time in zip(
+            meta["time_signature"], meta["time_signature_times"]
+        )
+    ]
+    song.key_signature_changes = []
+    for (_, (sharps, minor)), time in zip(
+        meta["key_signature"], meta["key_signature_times"]
+    ):
+        if not -7 <= sharps <= 7 or minor not in (0, 1):
+            raise ValueError(f"key signature of {sharps} sharps, mode {minor}")
+        # pitch class of the major key with this many sharps, 12 + the minor key's
+        keyNumber = (sharps * 7) % 12 if not minor else (sharps * 7 + 9) % 12 + 12
+        song.key_signature_changes.append(pretty_midi.KeySignature(keyNumber, time))
+    song.text_events = [
+        pretty_midi.Text(text, time)
+        for (_, text), time in zip(meta["text"], meta["text_times"])
+    ]
+    song.lyrics = [
+        pretty_midi.Lyric(text, time)
+        for (_, text), time in zip(meta["lyrics"], meta["lyrics_times"])
+    ]
+    for part in parts.values():
+        starts = np.array(part.start, dtype=np.int64)
+        ends = np.array(part.end, dtype=np.int64)
+        notes = NoteStore.from_arrays(
+            np.array(part.pitch, dtype=np.uint8),
+            np.array(part.velocity, dtype=np.uint8),
+            seconds(starts),
+            seconds(ends),
+            starts,
+            ends,
+        )
+        controlEnd = (
+            float(seconds([part.controls[0]])[0]) if part.controls[0] >= 0 else None
+        )
+        song.instruments.append(
+            ArrayInstrument(
+                part.program,
+                part.channel == DRUM_CHANNEL,
+                part.name,
+                notes,
+                controlEnd,
+            )
+        )
+    return song
+
+
+def read_midi(midi_file):
+    """Reads a standard midi file into a PrettyMIDI object holding ArrayInstruments.
+
+    The file is memory-mapped and its events are read straight into the
+    arrays of each instrument's NoteStore, which write_to_xml converts from
+    without Note objects. Times, instruments, note order and signatures are
+    the ones pretty_midi.PrettyMIDI reads from the same file, so the score
+    written is the same. The song can be written, rendered to a piano roll
+    and so on as any PrettyMIDI, but its notes are read only and control
+    changes and pitch bends are dropped (see ArrayInstrument).
+
+    Args:
+    midi_file : str, PathLike or bytes-like
+        path of the .mid file, or its contents
+
+    Returns:
+        the song, as a PrettyMIDI object
+    """
+    if not isinstance(midi_file, (str, os.PathLike)):
+        return parse_midi(memoryview(midi_file))
+    with open(midi_file, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as data:
+                return parse_midi(data)
@@ -0,0 +1,272 @@
+# live conversion - turns timed midi events, as they are played, into musicxml
+# measures, each written as soon as the next downbeat has passed
+
+import numpy as np
+import pretty_midi
+
+from main import (
+    DEFAULT_TEMPO,
+    DIVISIONS,
+    MEASURE_COLUMNS,
+    part_list,
+    quantize_notes,
+    serialize_measure,
+    ticks_to_divisions,
+)
+
+# midi channel of drums, which are not written (as in write_score)
+DRUM_CHANNEL = 9
+# ticks per quarter note times are rounded through, as pretty_midi reads files with by default
+RESOLUTION = 220
+
+
+class StreamPart:
+    """The notes of one midi channel still needed to write its next measures.
+
+    Args:
+    instId : str
+        id of the part ('P1', 'P2', etc.)
+    instrument : Instrument
+        pretty_midi instrument the part is named after
+    """
+
+    def __init__(self, instId, instrument):
+        self.instId = instId
+        self.instrument = instrument
+        # start division of the notes sounding, by pitch
+        self.open = {}
+        # (start, end, pitch) of the notes that ended, in the order they ended,
+        # dropped once the measures they are in are written
+        self.finished = []
+        # clef, worked out from the notes held when the part's first measure is written
+        self.clef_type = None
+
+
+class MeasureStream:
+    """Converts timed midi events to musicxml measures while they are played.
+
+    Events are fed in time order. A measure is written once an event comes
+    after its end, so the preview trails the playing by at most a measure,
+    and only the notes still sounding or in measures not yet written are
+    kept, so memory grows with the polyphony rather than the recording.
+    Notes are quantized and written as write_score writes the song
+    pretty_midi reads from a file of the same events, except that a part's
+    clef is worked out from the notes it holds when its first measure is
+    written; notes sounding over a barline are tied into the next measure.
+
+    Every part has every measure, so the measures can be put together into
+    a score-partwise document. A part first played after some measures
+    were written starts with whole rests for them, written as soon as its
+    first note is, with the attributes in measure 1. part_list lists the
+    parts played so far, so it is complete once finish is called.
+
+    Tempo, meter and key are fixed for the whole stream.
+
+    Args:
+    tempo : float
+        quarter notes per minute the events are played at
+    time_signature : tuple
+        (numerator, denominator) of the meter
+    key_number : int
+        key of the music, as pretty_midi numbers them (0 is C major)
+    snap : int
+        note positions are rounded to a multiple of this many divisions, see write_score
+    """
+
+    def __init__(
+        self, tempo=DEFAULT_TEMPO, time_signature=(4, 4), key_number=0, snap=1
+    ):
+        # seconds per tick
+        self.per_tick = 60.0 / (tempo * RESOLUTION)
+        self.time_signature = pretty_midi.TimeSignature(*time_signature, 0)
+        self.key_accidentals = pretty_midi.key_number_to_mode_accidentals(key_number)[1]
+        self.snap = snap
+        # divisions in a measure
+        self.dpm = DIVISIONS * 4 * time_signature[0] // time_signature[1]
+        # index of the first measure not yet written
+        self.measure = 0
+        # division of the latest event
+        self.position = 0
+        # parts by channel, in the order their first notes were played
+        self.parts = {}
+        self.programs = {}
+
+    def divisions(self, time):
+        """returns the division a time in seconds is quantized to"""
+        # rounded half to even, as seconds_to_ticks rounds
+        ticks = round(time / self.per_tick)
+        return int(ticks_to_divisions(ticks, RESOLUTION, self.snap))
+
+    def part_list(self):
+        """returns the serialized part-list of the parts played so far"""
+        return part_list(
+            [(part.instId, part.instrument) for part in self.parts.values()]
+        )
+
+    def feed(self, time, message):
+        """Reads one event.
+
+        Args:
+        time : float
+            seconds from the start of the recording the event happened at,
+            no earlier than the event before
+        message : mido.Message
+            the event; notes and program changes are read, and any other
+            message (such as a clock) only moves time on
+
+        Returns:
+            a list of (part id, measure number, serialized measure) of the
+            measures that ended before the event, then of the measures
+            already written for other parts if the event starts a new part
+        """
+        division = self.divisions(time)
+        self.position = max(self.position, division)
+        # a measure is written once an event comes after its end: a note
+        # ending later can no longer end on its barline
+        measures = []
+        while self.position > (self.measure + 1) * self.dpm:
+            measures.extend(self.write_measure())
+        channel = getattr(message, "channel", None)
+        if channel is None or channel == DRUM_CHANNEL:
+            return measures
+        if message.type == "program_change":
+            self.programs[channel] = message.program
+        elif message.type == "note_on" and message.velocity > 0:
+            part = self.parts.get(channel)
+            if part is None:
+                part = self.parts[channel] = StreamPart(
+                    f"P{len(self.parts) + 1}",
+                    pretty_midi.Instrument(
+                        self.programs.get(channel, 0), name=f"Channel {channel + 1}"
+                    ),
+                )
+                part.open[message.note] = [division]
+                # rests in the measures the other parts have been written up to
+                for measure in range(self.measure):
+                    measures.append(self.write_part_measure(part, measure))
+            else:
+                part.open.setdefault(message.note, []).append(division)
+        elif message.type in ("note_on", "note_off") and channel in self.parts:
+            part = self.parts[channel]
+            starts = part.open.get(message.note, [])
+            # as pretty_midi pairs them, a note-off ends every note of its
+            # pitch started before it, and keeps one started with it open
+            ended = [start for start in starts if start != division]
+            if ended:
+                part.open[message.note] = [
+                    start for start in starts if start == division
+                ]
+                for start in ended:
+                    end = max(division, start + self.snap)
+                    part.finished.append((start, end, message.note))
+        return measures
+
+    def finish(self, time=None):
+        """Ends the recording, ending every note still sounding.
+
+        Args:
+        time : float
+            seconds the recording ends at, the latest event if None
+
+        Returns:
+            a list of (part id, measure number, serialized measure) of the
+            measures not yet written, up to the one the last note ends in
+        """
+        if time is not None:
+            self.position = max(self.position, self.divisions(time))
+        end = self.position
+        for part in self.parts.values():
+            for pitch, starts in part.open.items():
+                for start in starts:
+                    part.finished.append(
+                        (start, max(self.position, start + self.snap), pitch)
+                    )
+            part.open = {}
+            end = max([end] + [noteEnd for _, noteEnd, _ in part.finished])
+        measures = []
+        # measures are written up to the end of the song, at least one
+        while self.measure == 0 or self.measure * self.dpm < end:
+            measures.extend(self.write_measure())
+        return measures
+
+    def write_measure(self):
+        """writes the next measure of every part and returns its (part id, measure number, serialized measure)"""
+        measures = [
+            self.write_part_measure(part, self.measure) for part in self.parts.values()
+        ]
+        self.measure += 1
+        return measures
+
+    def write_part_measure(self, part, measure):
+        """writes a measure (index from 0) of one part and returns its (part id, measure number, serialized measure)"""
+        downbeat = measure * self.dpm
+        nextDownbeat = downbeat + self.dpm
+        notes = [
+            (start, end, pitch)
+            for start, end, pitch in part.finished
+            if start < nextDownbeat and end > downbeat
+        ]
+        # notes still sounding carry over into the next measure
+        notes.extend(
+            (start, nextDownbeat + self.snap, pitch)
+            for pitch, starts in part.open.items()
+            for start in starts
+            if start < nextDownbeat
+        )
+        starts, ends, pitches = np.array(notes, dtype=np.int64).reshape(-1, 3).T
+        if part.clef_type is None:
+            # notes from C4 (midi 60) up count as treble, see quantize_part
+            held = [pitch for _, _, pitch in part.finished] + [
+                pitch for pitch, starts in part.open.items() for _ in starts
+            ]
+            treble = sum(pitch >= 60 for pitch in held)
+            part.clef_type = "treble" if treble >= len(held) - treble else "bass"
+            clef_type = part.clef_type
+            currentTime = self.time_signature
+            keyAccidentals = self.key_accidentals
+        else:
+            clef_type = currentTime = keyAccidentals = None
+        quantized = quantize_notes(
+            starts, ends, pitches, np.array([downbeat]), np.array([nextDownbeat])
+        )
+        measureArgs = (
+            measure + 1,
+            False,
+            currentTime,
+            keyAccidentals,
+            clef_type,
+            self.dpm,
+            tuple(quantized[column] for column in MEASURE_COLUMNS),
+        )
+        # notes ending by the next downbeat are not needed again
+        part.finished = [note for note in part.finished if note[1] > nextDownbeat]
+        return part.instId, measure + 1, serialize_measure(measureArgs)
+
+
+def stream_measures(events, **options):
+    """Converts an iterator of timed midi events to musicxml measures while it is read.
+
+    Args:
+    events : iterable
+        (seconds, mido.Message) of each event, in time order
+    options
+        see MeasureStream
+
+    Yields:
+        (part id, measure number, serialized measure) of each measure, as
+        soon as an event after its end is read
+    """
+    stream = MeasureStream(**options)
+    for time, message in events:
+        yield from stream.feed(time, message)
+    yield from stream.finish()
+
+
+async def stream_measures_async(events, **options):
+    """Converts an async iterator of timed midi events to musicxml measures, see stream_measures."""
+    stream = MeasureStream(**options)
+    async for time, message in events:
+        for measure in stream.feed(time, message):
+            yield measure
+    for measure in stream.finish():
+        yield measure
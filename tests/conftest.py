@@ -0,0 +1,14 @@
+import pretty_midi
+import pytest
+
+
+@pytest.fixture
+def piano_song():
+    """one bar of 4/4 in C major: a piano playing middle C for the first beat"""
+    song = pretty_midi.PrettyMIDI()
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    song.key_signature_changes.append(pretty_midi.KeySignature(0, 0))
+    piano = pretty_midi.Instrument(program=0, name="Piano")
+    piano.notes.append(pretty_midi.Note(100, 60, 0.0, 1.0))
+    song.instruments.append(piano)
+    return song
@@ -0,0 +1,59 @@
+import pytest
+
+from bench import WORKLOADS, compare, main, run_benchmarks
+
+
+@pytest.mark.parametrize("workload", sorted(WORKLOADS))
+def test_workloads(workload):
+    # Act
+    song = WORKLOADS[workload](0.05)
+
+    # Assert
+    assert song.instruments and all(part.notes for part in song.instruments)
+    assert song.time_signature_changes and song.key_signature_changes
+
+
+def test_run_benchmarks():
+    # Act
+    results = run_benchmarks(["write_to_xml/dense", "create_note"], 0.05, repeats=1)
+
+    # Assert
+    assert sorted(results) == ["create_note", "write_to_xml/dense_piano"]
+    assert all(r["seconds"] > 0 and r["peak_bytes"] > 0 for r in results.values())
+
+
+def test_compare():
+    # Arrange
+    baseline = {
+        "fast": {"seconds": 1.0, "peak_bytes": 100},
+        "slow": {"seconds": 1.0, "peak_bytes": 100},
+        "short": {"seconds": 0.001, "peak_bytes": 100},
+    }
+    results = {
+        "fast": {"seconds": 1.2, "peak_bytes": 100},
+        "slow": {"seconds": 1.5, "peak_bytes": 200},
+        "short": {"seconds": 0.002, "peak_bytes": 100},
+        "new": {"seconds": 9.0, "peak_bytes": 900},
+        "unavailable": None,
+    }
+
+    # Act
+    regressions = compare(results, baseline, threshold=1.25)
+
+    # Assert
+    assert regressions == [("slow", "seconds", 1.5), ("slow", "peak_bytes", 2.0)]
+
+
+def test_check_against_saved_baseline(tmp_path):
+    # Arrange
+    baseline = str(tmp_path / "baseline.json")
+    args = ["get_note_type", "--scale", "0.05", "-r", "1", "-b", baseline]
+
+    # Act
+    saved = main(args + ["--save"])
+    checked = main(args + ["--check", "--threshold", "1000"])
+
+    # Assert
+    assert saved == 0 and checked == 0
+    with pytest.raises(SystemExit):
+        main(["get_note_type", "--scale", "0.1", "-b", baseline, "--check"])
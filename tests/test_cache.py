@@ -0,0 +1,74 @@
+import os
+import zipfile
+
+from cache import ConversionCache
+from main import write_to_xml
+from midi2xml import collect_inputs, convert_batch
+
+
+def test_cache_get_put(tmp_path):
+    # Arrange
+    cache = ConversionCache(str(tmp_path))
+    key = cache.key(b"midi", {"format": "xml"})
+
+    # Act
+    missed = cache.get(key)
+    cache.put(key, b"<score-partwise/>")
+    hit = cache.get(key)
+
+    # Assert
+    assert missed is None and hit == b"<score-partwise/>"
+    assert key != cache.key(b"midi", {"format": "mxl"})
+    assert key != cache.key(b"midi!", {"format": "xml"})
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 1,
+        "writes": 1,
+        "evictions": 0,
+        "bytes": 17,
+    }
+    # the entry was renamed into place, leaving no temporary file behind
+    assert os.listdir(os.path.dirname(cache.path(key))) == [key]
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    # Arrange
+    cache = ConversionCache(str(tmp_path), max_bytes=30)
+    keys = [cache.key(name) for name in (b"a", b"b", b"c", b"d")]
+    for when, key in enumerate(keys[:3]):
+        cache.put(key, b"x" * 10)
+        os.utime(cache.path(key), (when, when))
+
+    # Act
+    cache.get(keys[0])
+    cache.put(keys[3], b"x" * 10)
+
+    # Assert
+    assert [cache.get(key) is not None for key in keys] == [True, False, True, True]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 30
+    # a new instance sees the entries left by the first
+    assert ConversionCache(str(tmp_path)).stats()["bytes"] == 30
+
+
+def test_convert_batch_cache(tmp_path, piano_song):
+    # Arrange
+    for name in ["first", "copy"]:
+        piano_song.write(str(tmp_path / f"{name}.mid"))
+    inputs = collect_inputs([str(tmp_path)])
+    cacheDir = str(tmp_path / "cache")
+
+    # Act
+    first = convert_batch(inputs, extension=".mxl", workers=1, cache_dir=cacheDir)
+    again = convert_batch(
+        inputs, extension=".mxl", workers=1, force=True, cache_dir=cacheDir
+    )
+
+    # Assert
+    assert first == {"converted": 2, "skipped": 0, "failed": 0, "cached": 1}
+    assert again == {"converted": 2, "skipped": 0, "failed": 0, "cached": 2}
+    write_to_xml(piano_song, str(tmp_path / "direct.mxl"))
+    with zipfile.ZipFile(tmp_path / "direct.mxl") as archive:
+        expected = archive.read("direct.xml")
+    with zipfile.ZipFile(tmp_path / "copy.mxl") as archive:
+        assert archive.read("copy.xml") == expected
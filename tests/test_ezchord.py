@@ -0,0 +1,207 @@
+import io
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import music21
+from ezchord import (
+    chord_fragment,
+    chord_pitches,
+    chord_progression_to_midi,
+    chord_progression_to_xml,
+    progression_pitches,
+    voice,
+    voicings,
+)
+from main import read_from_xml
+
+# the progression of bminor-chordprog-example.txt.rtf
+BMINOR_EXAMPLE = (
+    "B min7, A maj add 13, F# min7, G maj7, F# 7(no3) / E, A maj7, D maj7, C# 7(no3)"
+)
+
+
+@pytest.mark.parametrize(
+    "chord, pitches",
+    [
+        ("C", (48, 60, 64, 67)),
+        ("Am7", (45, 57, 60, 64, 67)),
+        ("Cmaj7", (48, 60, 64, 67, 71)),
+        ("G7", (55, 67, 71, 74, 77)),
+        ("C/G", (55, 60, 64, 67)),
+        ("Fsus4", (53, 65, 70, 72, 70)),
+        ("C6/9", (48, 60, 64, 67, 69, 74)),
+    ],
+)
+def test_chord_pitches(chord, pitches):
+    # Act
+    result = chord_pitches(chord)
+
+    # Assert
+    assert result == pitches
+
+
+def test_chord_pitches_roman_numerals():
+    # Act
+    result = [chord_pitches(chord, "d")[1:] for chord in ("I", "ii", "V7")]
+
+    # Assert
+    assert result == [(62, 66, 69), (64, 67, 71), (69, 73, 76, 79)]
+
+
+def test_chord_pitches_unknown_root():
+    # Act / Assert
+    with pytest.raises(ValueError):
+        chord_pitches("Hmaj7")
+
+
+def test_progression_pitches():
+    # Act
+    result = progression_pitches(["Bm", "-", "NC", "F# 7(no3) / E"])
+
+    # Assert
+    assert result[0] == result[1] == (47, 59, 62, 66)
+    assert result[2] == ()
+    assert result[3][0] == 52
+
+
+def test_progression_pitches_spaced_names():
+    # Act
+    result = progression_pitches(BMINOR_EXAMPLE.split(","))
+
+    # Assert
+    assert result == [
+        chord_pitches(name)
+        for name in [
+            "Bmin7",
+            "Amajadd13",
+            "F#min7",
+            "Gmaj7",
+            "F#7(no3)/E",
+            "Amaj7",
+            "Dmaj7",
+            "C#7(no3)",
+        ]
+    ]
+    # B minor seventh, with D rather than the D sharp of B7
+    assert result[0] == (47, 59, 62, 66, 69)
+
+
+def test_chord_fragment_ties_each_value():
+    # Act
+    notes = ET.fromstring(f"<m>{chord_fragment((60, 64), 120, False, True)}</m>")
+
+    # Assert
+    assert [
+        (note.find("chord") is not None, note.findtext("pitch/step")) for note in notes
+    ] == [(False, "C"), (True, "E"), (False, "C"), (True, "E")]
+    assert [[tie.get("type") for tie in note.findall("tie")] for note in notes] == [
+        ["stop", "start"],
+        ["stop", "start"],
+        ["stop"],
+        ["stop"],
+    ]
+
+
+def test_chord_progression_to_xml_round_trip():
+    # Arrange
+    progression = ["C", "Am", "F", "G7", "C"]
+
+    # Act
+    score = chord_progression_to_xml(progression, chord_duration=1.5)
+    song = read_from_xml(io.BytesIO(score))
+
+    # Assert
+    root = ET.fromstring(score)
+    assert len(root.findall("part/measure")) == 2
+    # a chord every 1.5 quarter notes, at 120 bpm
+    notes = sorted(
+        (round(note.start / 0.75), note.pitch) for note in song.instruments[0].notes
+    )
+    expected = sorted(
+        (index, pitch)
+        for index, chord in enumerate(progression_pitches(progression))
+        for pitch in set(chord)
+    )
+    assert notes == expected
+
+
+def test_music21_module_renders_without_music21():
+    # Act
+    score = music21.chord_progression_to_xml(["Cmaj7", "Am7", "Dm7", "G7"])
+
+    # Assert
+    assert score == chord_progression_to_xml(["Cmaj7", "Am7", "Dm7", "G7"])
+
+
+def test_voice_moves_least():
+    # Arrange: C, G, F, C in root position
+    chords = [[48, 60, 64, 67], [55, 67, 71, 74], [53, 65, 69, 72], [48, 60, 64, 67]]
+
+    # Act
+    result = voice(chords)
+
+    # Assert
+    # the upper notes stay around C4 as inversions, the bass stays put
+    assert result == [
+        [48, 60, 64, 67],
+        [55, 59, 62, 67],
+        [53, 60, 65, 69],
+        [48, 60, 64, 67],
+    ]
+
+
+def test_voice_bminor_example():
+    # Arrange
+    progression = BMINOR_EXAMPLE.split(",")
+    chords = progression_pitches(progression)
+
+    def moved(chords):
+        """semitones each note moves to the nearest note of the next chord"""
+        return sum(
+            min(abs(pitch - other) for other in current)
+            for previous, current in zip(chords, chords[1:])
+            for pitch in previous
+        )
+
+    # Act
+    result = progression_pitches(progression, voice_leading=True)
+
+    # Assert
+    # each chord keeps its notes and its bass, and the notes move less than half as far
+    assert [{pitch % 12 for pitch in chord} for chord in result] == [
+        {pitch % 12 for pitch in chord} for chord in chords
+    ]
+    assert [min(chord) % 12 for chord in result] == [chord[0] % 12 for chord in chords]
+    assert moved(result) * 2 < moved(chords)
+
+
+def test_voicings_are_memoized():
+    # Act
+    first = voicings((48, 60, 64, 67))
+    second = voicings((48, 60, 64, 67))
+
+    # Assert
+    assert first is second
+    voiced, upper, upperIndexes = first
+    assert voiced[0].tolist() == [48, 60, 64, 67]
+    assert not voiced.flags.writeable
+    assert (voiced[:, 1:] == upper[upperIndexes]).all()
+    assert (voiced[:, 0] < voiced[:, 1]).all()
+
+
+def test_chord_progression_to_midi():
+    # Arrange
+    progression = ["Bm", "G", "D", "A"] * 4
+
+    # Act
+    song = chord_progression_to_midi(progression, chord_duration=2, voice_leading=True)
+
+    # Assert
+    notes = song.instruments[0].notes
+    assert len(notes) == 16 * 4
+    assert song.get_end_time() == 16.0
+    voiced = progression_pitches(progression, voice_leading=True)
+    assert sorted((round(n.start), n.pitch) for n in notes) == sorted(
+        (index, pitch) for index, chord in enumerate(voiced) for pitch in chord
+    )
@@ -1,8 +1,31 @@
-import pytest
 import xml.etree.ElementTree as ET
+
+import pretty_midi
+import pytest
+
 from main import write_measure_attributes
 
 
+def element(tag, *children, text=None):
+    """builds an Element from its tag, children and text"""
+    result = ET.Element(tag)
+    result.extend(children)
+    result.text = text
+    return result
+
+
+def attributes(fifths, beats, beatType, sign, line):
+    return element(
+        "attributes",
+        element("divisions", text="24"),
+        element("key", element("fifths", text=fifths)),
+        element(
+            "time", element("beats", text=beats), element("beat-type", text=beatType)
+        ),
+        element("clef", element("sign", text=sign), element("line", text=line)),
+    )
+
+
 @pytest.mark.parametrize(
     "current_measure, key_accidentals, time_signature, clef_type, expected",
     [
@@ -10,55 +33,31 @@ from main import write_measure_attributes
         (
             1,
             0,
-            ET.Element("time_signature", numerator="4", denominator="4"),
+            pretty_midi.TimeSignature(4, 4, 0),
             "treble",
-            ET.Element(
-                "attributes",
-                ET.Element("divisions", text="24"),
-                ET.Element("key", ET.Element("fifths", text="0")),
-                ET.Element(
-                    "time",
-                    ET.Element("beats", text="4"),
-                    ET.Element("beat-type", text="4"),
-                ),
-                ET.Element(
-                    "clef", ET.Element("sign", text="G"), ET.Element("line", text="2")
-                ),
-            ),
+            attributes("0", "4", "4", "G", "2"),
         ),
         (
             2,
             -2,
-            ET.Element("time_signature", numerator="3", denominator="8"),
+            pretty_midi.TimeSignature(3, 8, 0),
             "bass",
-            ET.Element(
-                "attributes",
-                ET.Element("divisions", text="24"),
-                ET.Element("key", ET.Element("fifths", text="-2")),
-                ET.Element(
-                    "time",
-                    ET.Element("beats", text="3"),
-                    ET.Element("beat-type", text="8"),
-                ),
-                ET.Element(
-                    "clef", ET.Element("sign", text="F"), ET.Element("line", text="4")
-                ),
-            ),
+            attributes("-2", "3", "8", "F", "4"),
         ),
-        # Negative cases
+        # Negative cases: anything but bass is written in the treble clef
         (
             3,
             1,
-            ET.Element("time_signature", numerator="5", denominator="4"),
+            pretty_midi.TimeSignature(5, 4, 0),
             "invalid",
-            None,
+            attributes("1", "5", "4", "G", "2"),
         ),
         (
             4,
             3,
-            ET.Element("time_signature", numerator="2", denominator="2"),
+            pretty_midi.TimeSignature(2, 2, 0),
             "treble",
-            None,
+            attributes("3", "2", "2", "G", "2"),
         ),
     ],
 )
@@ -74,3 +73,22 @@ def test_write_measure_attributes(
 
     # Assert
     assert ET.tostring(result) == ET.tostring(expected)
+
+
+def test_write_measure_attributes_changes_only():
+    # Act
+    keyOnly = write_measure_attributes(3, -1, None, None)
+    timeOnly = write_measure_attributes(
+        5, None, pretty_midi.TimeSignature(6, 8, 0), None
+    )
+
+    # Assert
+    assert ET.tostring(keyOnly) == ET.tostring(
+        element("attributes", element("key", element("fifths", text="-1")))
+    )
+    assert ET.tostring(timeOnly) == ET.tostring(
+        element(
+            "attributes",
+            element("time", element("beats", text="6"), element("beat-type", text="8")),
+        )
+    )
@@ -0,0 +1,79 @@
+import json
+import zipfile
+
+import pytest
+
+from midi2xml import collect_inputs, convert_batch, output_path
+
+
+@pytest.fixture
+def midi_dir(tmp_path, piano_song):
+    piano_song.write(str(tmp_path / "good.mid"))
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "broken.mid").write_bytes(b"not a midi file")
+    (tmp_path / "notes.txt").write_text("ignored")
+    return tmp_path
+
+
+def test_collect_inputs(midi_dir):
+    # Act
+    inputs = collect_inputs([str(midi_dir), str(midi_dir / "*.mid")])
+
+    # Assert
+    assert inputs == [
+        str(midi_dir / "good.mid"),
+        str(midi_dir / "nested" / "broken.mid"),
+    ]
+
+
+def test_convert_batch_resumes(midi_dir):
+    # Arrange
+    inputs = collect_inputs([str(midi_dir)])
+    manifest = str(midi_dir / "manifest.jsonl")
+
+    # Act
+    first = convert_batch(inputs, manifest=manifest, workers=1)
+    second = convert_batch(inputs, manifest=manifest, workers=1)
+    retried = convert_batch(inputs, manifest=manifest, workers=1, retry_failed=True)
+
+    # Assert
+    assert first == {"converted": 1, "skipped": 0, "failed": 1}
+    assert second == {"converted": 0, "skipped": 2, "failed": 0}
+    assert retried == {"converted": 0, "skipped": 1, "failed": 1}
+    with open(output_path(str(midi_dir / "good.mid"))) as file:
+        assert "<score-partwise>" in file.read()
+    with open(manifest) as file:
+        statuses = [json.loads(line)["status"] for line in file]
+    assert sorted(statuses[:2]) == ["converted", "failed"]
+    assert statuses[2] == "failed"
+
+
+def test_convert_batch_keeps_relative_paths(tmp_path, piano_song):
+    # Arrange
+    for folder in ["a", "b"]:
+        (tmp_path / "in" / folder).mkdir(parents=True)
+        piano_song.write(str(tmp_path / "in" / folder / "song.mid"))
+    piano_song.write(str(tmp_path / "in" / "a" / "song.midi"))
+    inputs = collect_inputs([str(tmp_path / "in")])
+    records = []
+
+    # Act
+    counts = convert_batch(
+        inputs,
+        output_dir=str(tmp_path / "out"),
+        extension=".mxl",
+        workers=1,
+        progress=lambda done, total, record: records.append(record),
+    )
+
+    # Assert
+    assert counts == {"converted": 2, "skipped": 0, "failed": 1}
+    (collision,) = [record for record in records if record["status"] == "failed"]
+    assert collision["input"] == str(tmp_path / "in" / "a" / "song.midi")
+    for folder in ["a", "b"]:
+        with zipfile.ZipFile(tmp_path / "out" / folder / "song.mxl") as archive:
+            assert "song.xml" in archive.namelist()
+            assert 'full-path="song.xml"' in archive.read(
+                "META-INF/container.xml"
+            ).decode("utf-8")
+    assert sorted(p.name for p in (tmp_path / "out" / "a").iterdir()) == ["song.mxl"]
@@ -0,0 +1,96 @@
+import xml.etree.ElementTree as ET
+
+import pretty_midi
+import pytest
+
+from main import create_note, create_rest, note_segments, split_duration
+
+
+@pytest.mark.parametrize(
+    "duration, segments",
+    [
+        (22, (("eighth", 2, 22),)),
+        (23, (("quarter", 0, 23),)),
+        (84, (("half", 2, 84),)),
+        (120, (("whole", 0, 96), ("quarter", 0, 24))),
+        (768, (("breve", 0, 192),) * 4),
+        (769, (("breve", 0, 192),) * 3 + (("breve", 0, 193),)),
+    ],
+)
+def test_note_segments(duration, segments):
+    # Act
+    result = note_segments(duration)
+
+    # Assert
+    assert result == segments
+    assert result == split_duration(duration)
+
+
+@pytest.mark.parametrize(
+    "duration, rests",
+    [
+        (72, [("72", "half", 1)]),
+        (120, [("96", "whole", 0), ("24", "quarter", 0)]),
+    ],
+)
+def test_create_rest(duration, rests):
+    # Act
+    result = create_rest(duration)
+
+    # Assert
+    assert [
+        (
+            rest.find("duration").text,
+            rest.find("type").text,
+            len(rest.findall("dot")),
+        )
+        for rest in result
+    ] == rests
+    assert all(rest.find("rest") is not None for rest in result)
+
+
+def test_create_note_tied_compound():
+    # Act
+    first, second = create_note("C#4", 108, None, True, False, 2)
+
+    # Assert
+    assert [tie.get("type") for tie in first.findall("tie")] == ["start"]
+    assert [tie.get("type") for tie in second.findall("tie")] == ["stop", "start"]
+    assert (first.find("type").text, len(first.findall("dot"))) == ("whole", 0)
+    assert (second.find("type").text, len(second.findall("dot"))) == ("eighth", 0)
+    assert [note.find("duration").text for note in (first, second)] == ["96", "12"]
+    assert second.findtext("pitch/alter") == "1"
+    assert second.findtext("voice") == "2"
+
+
+def test_create_note_dotted():
+    # Act
+    (note,) = create_note("Bb3", 36)
+
+    # Assert
+    assert note.find("tie") is None
+    assert ET.tostring(note.find("type")) == b"<type>quarter</type>"
+    assert len(note.findall("dot")) == 1
+
+
+def test_create_note_note_type_is_deprecated():
+    # Act
+    with pytest.warns(DeprecationWarning):
+        notes = create_note("C4", 24, "half")
+
+    # Assert
+    assert [note.find("type").text for note in notes] == ["quarter"]
+
+
+def test_create_note_from_pitch_number():
+    # Act
+    byNumber = [create_note(pitch, 36, None, False, True, 2) for pitch in range(128)]
+    byName = [
+        create_note(pretty_midi.note_number_to_name(pitch), 36, None, False, True, 2)
+        for pitch in range(128)
+    ]
+
+    # Assert
+    assert [[ET.tostring(note) for note in notes] for notes in byNumber] == [
+        [ET.tostring(note) for note in notes] for notes in byName
+    ]
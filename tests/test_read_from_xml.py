@@ -0,0 +1,115 @@
+import pretty_midi
+import pytest
+
+from main import ConversionStats, read_from_xml, write_to_xml
+
+SCORE = """<?xml version="1.0" encoding="UTF-8"?>
+<score-partwise>
+  <part-list><score-part id="P1"><part-name>Piano</part-name></score-part></part-list>
+  <part id="P1">
+    <measure number="1">
+      <attributes>
+        <divisions>2</divisions>
+        <key><fifths>-3</fifths><mode>minor</mode></key>
+        <time><beats>3</beats><beat-type>4</beat-type></time>
+      </attributes>
+      <direction><sound tempo="60"/></direction>
+      <note><pitch><step>C</step><octave>4</octave></pitch><duration>2</duration></note>
+      <note><chord/><pitch><step>E</step><alter>-1</alter><octave>4</octave></pitch><duration>2</duration></note>
+      <note><rest/><duration>2</duration></note>
+      <note>
+        <pitch><step>G</step><octave>4</octave></pitch><duration>2</duration><tie type="start"/>
+      </note>
+      <backup><duration>6</duration></backup>
+      <forward><duration>2</duration></forward>
+      <note><pitch><step>C</step><octave>3</octave></pitch><duration>1</duration></note>
+    </measure>
+    <measure number="2">
+      <note>
+        <pitch><step>G</step><octave>4</octave></pitch><duration>6</duration><tie type="stop"/>
+      </note>
+    </measure>
+  </part>
+</score-partwise>
+"""
+
+
+def test_read_from_xml(tmp_path):
+    # Arrange
+    path = tmp_path / "score.xml"
+    path.write_text(SCORE)
+
+    # Act
+    song = read_from_xml(str(path))
+
+    # Assert
+    (piano,) = song.instruments
+    assert piano.name == "Piano"
+    assert [(n.pitch, n.start, n.end) for n in piano.notes] == [
+        (60, 0.0, 1.0),
+        (63, 0.0, 1.0),
+        (67, 2.0, 6.0),
+        (48, 1.0, 1.5),
+    ]
+    assert [(ts.numerator, ts.denominator) for ts in song.time_signature_changes] == [
+        (3, 4)
+    ]
+    assert [ks.key_number for ks in song.key_signature_changes] == [12]
+    assert song.get_tempo_changes()[1].tolist() == [60.0]
+
+
+@pytest.mark.parametrize("filename", ["song.xml", "song.mxl"])
+def test_read_from_xml_round_trip(tmp_path, filename, piano_song):
+    # Arrange
+    piano_song.key_signature_changes[0] = pretty_midi.KeySignature(2, 0)
+    (piano,) = piano_song.instruments
+    for start, pitch, length in [(1, 64, 0.5), (1.5, 67, 2), (3.5, 72, 0.5)]:
+        piano.notes.append(pretty_midi.Note(100, pitch, start, start + length))
+    expected = [(n.pitch, n.start, n.end) for n in piano.notes]
+    path = str(tmp_path / filename)
+
+    # Act
+    write_to_xml(piano_song, path)
+    result = read_from_xml(path)
+
+    # Assert
+    assert [(n.pitch, n.start, n.end) for n in result.instruments[0].notes] == expected
+    assert [ks.key_number for ks in result.key_signature_changes] == [2]
+
+
+def test_read_from_xml_round_trip_measures_ending_early(tmp_path, piano_song):
+    # Arrange: the first two measures end before their barlines
+    (piano,) = piano_song.instruments
+    for start, pitch, length in [(2, 64, 0.5), (4, 67, 0.5)]:
+        piano.notes.append(pretty_midi.Note(100, pitch, start, start + length))
+    expected = [(n.pitch, n.start, n.end) for n in piano.notes]
+    path = str(tmp_path / "song.xml")
+
+    # Act
+    write_to_xml(piano_song, path)
+    result = read_from_xml(path)
+
+    # Assert
+    assert [(n.pitch, n.start, n.end) for n in result.instruments[0].notes] == expected
+
+
+def test_read_from_xml_stats(tmp_path):
+    # Arrange
+    path = tmp_path / "score.xml"
+    path.write_text(SCORE)
+    reported = []
+    stats = ConversionStats(reported.append)
+
+    # Act
+    read_from_xml(str(path), stats=stats)
+
+    # Assert
+    assert stats.counts == {
+        "parts": 1,
+        "measures": 2,
+        "notes": 4,
+        "ties": 1,
+        "input_bytes": path.stat().st_size,
+    }
+    assert set(stats.stages) == {"parse", "timing"}
+    assert reported == [stats.as_dict()]
@@ -0,0 +1,172 @@
+import asyncio
+import io
+import json
+
+import pretty_midi
+
+from cache import ConversionCache
+from server import ConversionServer
+
+
+async def request(port, method, path, body=b"", length=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    length = len(body) if length is None else length
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nContent-Length: {length}\r\n"
+        "Connection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), content
+
+
+def test_server_round_trip(piano_song):
+    # Arrange
+    midi = io.BytesIO()
+    piano_song.write(midi)
+
+    async def run():
+        server = ConversionServer(workers=1)
+        server.start_pool()
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            return (
+                await request(port, "POST", "/midi2xml", midi.getvalue()),
+                await request(port, "POST", "/xml2midi?", b""),
+                await request(port, "POST", "/xml2midi", b"not xml"),
+                await request(port, "POST", "/midi2xml", b"", length="x"),
+                await request(port, "POST", "/nowhere"),
+                await request(port, "GET", "/health"),
+            )
+        finally:
+            listener.close()
+            server.close()
+
+    # Act
+    xml, empty, bad, badLength, missing, health = asyncio.run(
+        asyncio.wait_for(run(), timeout=60)
+    )
+
+    # Assert
+    assert xml[0] == 200 and b"<score-partwise>" in xml[1]
+    assert empty[0] == 400 and bad[0] == 400
+    assert badLength[0] == 400
+    assert missing[0] == 404
+    assert json.loads(health[1])["completed"] == 1
+
+
+def test_server_xml_to_midi(piano_song):
+    # Arrange
+    async def run():
+        server = ConversionServer(workers=1)
+        server.start_pool()
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            _, xml = await request(port, "POST", "/midi2xml", midi)
+            return await request(port, "POST", "/xml2midi", xml)
+        finally:
+            listener.close()
+            server.close()
+
+    midi = io.BytesIO()
+    piano_song.write(midi)
+    midi = midi.getvalue()
+
+    # Act
+    status, result = asyncio.run(asyncio.wait_for(run(), timeout=60))
+
+    # Assert
+    assert status == 200
+    song = pretty_midi.PrettyMIDI(io.BytesIO(result))
+    assert [note.pitch for note in song.instruments[0].notes] == [60]
+
+
+def test_server_replaces_broken_pool(piano_song):
+    # Arrange
+    midi = io.BytesIO()
+    piano_song.write(midi)
+
+    async def run():
+        server = ConversionServer(workers=1)
+        server.start_pool()
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            for process in list(server.pool._processes.values()):
+                process.kill()
+                process.join()
+            broken = await request(port, "POST", "/midi2xml", midi.getvalue())
+            recovered = await request(port, "POST", "/midi2xml", midi.getvalue())
+            return broken, recovered
+        finally:
+            listener.close()
+            server.close()
+
+    # Act
+    broken, recovered = asyncio.run(asyncio.wait_for(run(), timeout=60))
+
+    # Assert
+    assert broken[0] == 500
+    assert recovered[0] == 200
+
+
+def test_server_cache(tmp_path, piano_song):
+    # Arrange
+    midi = io.BytesIO()
+    piano_song.write(midi)
+
+    async def run():
+        server = ConversionServer(workers=1, cache=ConversionCache(str(tmp_path)))
+        server.start_pool()
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            return (
+                await request(port, "POST", "/midi2xml", midi.getvalue()),
+                await request(port, "POST", "/midi2xml", midi.getvalue()),
+                await request(port, "POST", "/midi2xml?format=mxl", midi.getvalue()),
+                await request(port, "GET", "/health"),
+            )
+        finally:
+            listener.close()
+            server.close()
+
+    # Act
+    first, second, mxl, health = asyncio.run(asyncio.wait_for(run(), timeout=60))
+
+    # Assert
+    assert first == second
+    assert mxl[1].startswith(b"PK")
+    stats = json.loads(health[1])
+    assert stats["completed"] == 3
+    assert (stats["cache"]["hits"], stats["cache"]["misses"]) == (1, 2)
+
+
+def test_server_chords():
+    # Arrange
+    async def run():
+        server = ConversionServer(workers=1)
+        server.start_pool()
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            return (
+                await request(port, "POST", "/chords2xml", b"Cmaj7, Am7, Dm7, G7"),
+                await request(port, "POST", "/chords2xml?voice=1", b"C Am F G"),
+                await request(port, "POST", "/chords2xml", b"Hmaj7"),
+            )
+        finally:
+            listener.close()
+            server.close()
+
+    # Act
+    commas, voiced, bad = asyncio.run(asyncio.wait_for(run(), timeout=60))
+
+    # Assert
+    assert commas[0] == 200 and commas[1].count(b"<chord />") == 16
+    assert voiced[0] == 200 and b"<score-partwise>" in voiced[1]
+    assert bad[0] == 400
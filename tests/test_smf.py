@@ -0,0 +1,138 @@
+import io
+import struct
+
+import pretty_midi
+import pytest
+
+from bench import WORKLOADS
+from main import write_score
+from smf import read_midi
+
+
+def midi_bytes(song):
+    midi = io.BytesIO()
+    song.write(midi)
+    return midi.getvalue()
+
+
+def score(song):
+    file = io.StringIO()
+    write_score(file, song)
+    return file.getvalue()
+
+
+def assert_same_song(song, expected):
+    assert [(part.program, part.is_drum, part.name) for part in song.instruments] == [
+        (part.program, part.is_drum, part.name) for part in expected.instruments
+    ]
+    for part, expectedPart in zip(song.instruments, expected.instruments):
+        assert part.notes.pitch.tolist() == [note.pitch for note in expectedPart.notes]
+        assert part.notes.start.tolist() == [note.start for note in expectedPart.notes]
+        assert part.notes.end.tolist() == [note.end for note in expectedPart.notes]
+    assert song.get_end_time() == expected.get_end_time()
+
+
+def track(*events):
+    """an MTrk chunk of raw (delta ticks, event bytes) pairs, deltas of one byte"""
+    body = b"".join(bytes([delta]) + event for delta, event in events)
+    return b"MTrk" + struct.pack(">I", len(body)) + body
+
+
+# a type 1 file of 96 ticks per quarter note: a tempo change to 60 bpm after
+# one quarter note, and a named piano track written with running status,
+# note-ons of velocity 0 as note-offs and a meta event between running events
+HAND_WRITTEN = (
+    b"MThd"
+    + struct.pack(">IHHH", 6, 1, 2, 96)
+    + track(
+        (0, b"\xff\x58\x04\x03\x02\x18\x08"),
+        (0, b"\xff\x59\x02\xfe\x01"),
+        (96, b"\xff\x51\x03\x0f\x42\x40"),
+        (0, b"\xff\x2f\x00"),
+    )
+    + track(
+        (0, b"\xff\x03\x05Piano"),
+        (0, b"\xc0\x05"),
+        (0, b"\x90\x3c\x50"),
+        (0, b"\x40\x50"),
+        (96, b"\x3c\x00"),
+        (0, b"\xff\x01\x02hi"),
+        (48, b"\x40\x00"),
+        (0, b"\x43\x60"),
+        (120, b"\x80\x43\x00"),
+        (0, b"\xb0\x40\x7f"),
+        (100, b"\x40\x00"),
+        (0, b"\xff\x2f\x00"),
+    )
+)
+
+
+@pytest.mark.parametrize("workload", sorted(WORKLOADS))
+def test_read_midi_matches_pretty_midi(workload):
+    # Arrange
+    data = midi_bytes(WORKLOADS[workload](0.1))
+    expected = pretty_midi.PrettyMIDI(io.BytesIO(data))
+
+    # Act
+    song = read_midi(data)
+
+    # Assert
+    assert_same_song(song, expected)
+    assert score(song) == score(expected)
+
+
+def test_read_midi_hand_written_file(tmp_path):
+    # Arrange
+    path = tmp_path / "hand.mid"
+    path.write_bytes(HAND_WRITTEN)
+    expected = pretty_midi.PrettyMIDI(str(path))
+
+    # Act
+    song = read_midi(str(path))
+
+    # Assert
+    assert_same_song(song, expected)
+    assert song.instruments[0].name == "Piano" and song.instruments[0].program == 5
+    assert song.instruments[0].notes.end.tolist() == [0.5, 1.0, 2.25]
+    assert [
+        (sig.numerator, sig.denominator) for sig in song.time_signature_changes
+    ] == [(3, 4)]
+    # two flats, minor: G minor
+    assert [key.key_number for key in song.key_signature_changes] == [19]
+    assert [text.text for text in song.text_events] == ["hi"]
+    assert score(song) == score(expected)
+
+
+@pytest.mark.parametrize(
+    "data, error",
+    [
+        (b"RIFF" + bytes(10), ValueError),
+        (HAND_WRITTEN[:30], EOFError),
+        (b"MThd" + struct.pack(">IHHH", 6, 1, 1, 0xE728), ValueError),
+    ],
+)
+def test_read_midi_rejects_bad_files(data, error):
+    # Act / Assert
+    with pytest.raises(error):
+        read_midi(data)
+
+
+def test_read_midi_song_works_as_pretty_midi():
+    # Arrange
+    data = midi_bytes(WORKLOADS["dense_piano"](0.05))
+    expected = pretty_midi.PrettyMIDI(io.BytesIO(data))
+    song = read_midi(data)
+
+    # Act
+    written = midi_bytes(song)
+
+    # Assert
+    (notes,) = [part.notes for part in song.instruments]
+    (expectedNotes,) = [part.notes for part in expected.instruments]
+    assert [(n.pitch, n.start, n.end) for n in notes] == [
+        (n.pitch, n.start, n.end) for n in expectedNotes
+    ]
+    assert str(notes[-1]) == str(expectedNotes[-1])
+    assert [str(n) for n in notes[1:3]] == [str(n) for n in expectedNotes[1:3]]
+    assert (song.get_piano_roll() == expected.get_piano_roll()).all()
+    assert written == midi_bytes(expected)
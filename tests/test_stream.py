@@ -0,0 +1,184 @@
+import asyncio
+import io
+import xml.etree.ElementTree as ET
+
+import mido
+import pretty_midi
+
+from main import write_score
+from stream import MeasureStream, stream_measures, stream_measures_async
+
+
+def song_events(song):
+    """(seconds, message) of the note-ons and note-offs of a song, channel by instrument"""
+    events = []
+    for channel, instrument in enumerate(song.instruments):
+        for note in instrument.notes:
+            events.append(
+                (
+                    note.start,
+                    1,
+                    mido.Message("note_on", channel=channel, note=note.pitch),
+                )
+            )
+            events.append(
+                (
+                    note.end,
+                    0,
+                    mido.Message("note_off", channel=channel, note=note.pitch),
+                )
+            )
+    return [(time, message) for time, _, message in sorted(events, key=lambda e: e[:2])]
+
+
+def tied_song():
+    """two measures of 4/4 at 120 bpm: a chord, a melody and a note held over the barline"""
+    song = pretty_midi.PrettyMIDI(initial_tempo=120)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    piano = pretty_midi.Instrument(program=0, name="Channel 1")
+    for pitch, start, end in [
+        (60, 0.0, 1.0),
+        (64, 0.0, 1.0),
+        (72, 0.0, 0.5),
+        (74, 0.5, 1.0),
+        (67, 1.5, 2.5),
+        (65, 2.5, 3.25),
+    ]:
+        piano.notes.append(pretty_midi.Note(100, pitch, start, end))
+    song.instruments.append(piano)
+    return song
+
+
+def test_stream_measures_matches_write_score():
+    # Arrange: the song as pretty_midi reads it from a file, its notes in the order they end
+    midi = io.BytesIO()
+    tied_song().write(midi)
+    midi.seek(0)
+    song = pretty_midi.PrettyMIDI(midi)
+    score = io.StringIO()
+    write_score(score, song)
+    expected = [
+        ET.tostring(measure, encoding="unicode")
+        for measure in ET.fromstring(score.getvalue().split("\n", 1)[1]).iter("measure")
+    ]
+
+    # Act
+    measures = list(stream_measures(song_events(song)))
+
+    # Assert
+    assert [(instId, number) for instId, number, _ in measures] == [
+        ("P1", 1),
+        ("P1", 2),
+    ]
+    assert [fragment for _, _, fragment in measures] == expected
+
+
+def test_measure_stream_writes_measures_once_their_end_passes():
+    # Arrange
+    stream = MeasureStream()
+    on = mido.Message("note_on", note=67)
+    off = mido.Message("note_off", note=67)
+
+    # Act
+    started = stream.feed(1.5, on)
+    onBarline = stream.feed(2.0, mido.Message("clock"))
+    # an event after the barline ends the first measure, the G still sounding
+    (first,) = stream.feed(2.1, mido.Message("clock"))
+    ended = stream.feed(2.5, off)
+    (second,) = stream.finish()
+
+    # Assert
+    assert started == onBarline == ended == []
+    assert first[:2] == ("P1", 1)
+    assert second[:2] == ("P1", 2)
+    assert ET.fromstring(first[2]).find("note/tie").get("type") == "start"
+    assert ET.fromstring(second[2]).find("note/tie").get("type") == "stop"
+    assert ET.fromstring(second[2]).find("attributes") is None
+    # the G was dropped once the measure it ends in was written
+    assert stream.parts[0].finished == []
+
+
+def test_measure_stream_parts():
+    # Arrange
+    stream = MeasureStream(time_signature=(3, 4), key_number=7)
+    events = [
+        (0.0, mido.Message("program_change", channel=1, program=32)),
+        (0.0, mido.Message("note_on", channel=1, note=40)),
+        (0.0, mido.Message("note_on", channel=9, note=36)),
+        (1.6, mido.Message("note_on", channel=0, note=72)),
+        (2.0, mido.Message("note_off", channel=1, note=40)),
+        (2.0, mido.Message("note_off", channel=0, note=72)),
+    ]
+
+    # Act
+    measures = [measure for event in events for measure in stream.feed(*event)]
+    measures += stream.finish()
+
+    # Assert
+    # drums are left out, and a part first played in measure 2 starts with
+    # a rest in measure 1, written once its first note is
+    assert [(instId, number) for instId, number, _ in measures] == [
+        ("P1", 1),
+        ("P2", 1),
+        ("P1", 2),
+        ("P2", 2),
+    ]
+    fragments = [ET.fromstring(fragment) for _, _, fragment in measures]
+    assert [fragment.findtext("attributes/clef/sign") for fragment in fragments] == [
+        "F",
+        "G",
+        None,
+        None,
+    ]
+    assert fragments[1].findtext("attributes/key/fifths") == "1"
+    assert [note.find("rest") is not None for note in fragments[1].iter("note")] == [
+        True
+    ]
+    partList = ET.fromstring(stream.part_list())
+    assert [part.findtext("part-name") for part in partList] == [
+        "Channel 2",
+        "Channel 1",
+    ]
+    assert stream.parts[1].instrument.program == 32
+
+
+def test_measure_stream_every_part_has_every_measure():
+    # Arrange: a second part comes in during measure 3, before measure 2 is written
+    stream = MeasureStream()
+    events = [
+        (0.0, mido.Message("note_on", channel=0, note=60)),
+        (2.5, mido.Message("note_on", channel=1, note=48)),
+        (4.5, mido.Message("note_off", channel=0, note=60)),
+        (4.5, mido.Message("note_off", channel=1, note=48)),
+    ]
+
+    # Act
+    measures = [measure for event in events for measure in stream.feed(*event)]
+    measures += stream.finish()
+
+    # Assert
+    numbers = {}
+    for instId, number, _ in measures:
+        numbers.setdefault(instId, []).append(number)
+    assert numbers == {"P1": [1, 2, 3], "P2": [1, 2, 3]}
+    partList = ET.fromstring(stream.part_list())
+    assert [part.get("id") for part in partList] == ["P1", "P2"]
+
+
+def test_stream_measures_async():
+    # Arrange
+    events = song_events(tied_song())
+
+    async def play():
+        for event in events:
+            await asyncio.sleep(0)
+            yield event
+
+    async def run():
+        return [measure async for measure in stream_measures_async(play())]
+
+    # Act
+    measures = asyncio.run(run())
+
+    # Assert
+    assert measures == list(stream_measures(events))
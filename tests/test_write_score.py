@@ -0,0 +1,491 @@
+import io
+import json
+import os
+import xml.etree.ElementTree as ET
+import zipfile
+
+import pretty_midi
+import pytest
+
+from main import (
+    ConversionStats,
+    MeasureCache,
+    ScoreIndex,
+    assign_voices,
+    json_sink,
+    ticks_to_divisions,
+    write_score,
+    write_to_xml,
+)
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+
+
+@pytest.fixture
+def carried_song():
+    """three measures at 120 bpm, 4/4 changing to 3/4 in the third: a piano with
+    notes carried over barlines and one rounding into the next measure, and a bass"""
+    song = pretty_midi.PrettyMIDI(initial_tempo=120)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    song.time_signature_changes.append(pretty_midi.TimeSignature(3, 4, 4.0))
+    song.key_signature_changes.append(pretty_midi.KeySignature(9, 0))
+    piano = pretty_midi.Instrument(program=0, name="Piano")
+    for pitch, start, end in [
+        (60, 0.0, 0.5),
+        (64, 0.5, 1.0),
+        (67, 1.5, 2.5),
+        (72, 1.999, 2.5),
+        (62, 3.5, 4.75),
+        (65, 4.75, 5.5),
+    ]:
+        piano.notes.append(pretty_midi.Note(100, pitch, start, end))
+    bass = pretty_midi.Instrument(program=32, name="Bass")
+    for pitch, start, end in [(40, 0.0, 2.0), (43, 2.0, 3.999), (45, 3.999, 5.5)]:
+        bass.notes.append(pretty_midi.Note(100, pitch, start, end))
+    song.instruments.extend([piano, bass])
+    return song
+
+
+def test_write_score_golden(carried_song):
+    # Arrange
+    with open(os.path.join(GOLDEN_DIR, "carried.xml"), encoding="UTF8") as file:
+        expected = file.read()
+    score = io.StringIO()
+
+    # Act
+    write_score(score, carried_song)
+
+    # Assert
+    assert score.getvalue() == expected
+
+
+def test_write_score_carries_notes_over_barlines(carried_song):
+    # Arrange
+    score = io.StringIO()
+
+    # Act
+    write_score(score, carried_song)
+
+    # Assert
+    piano = ET.fromstring(score.getvalue().split("\n", 1)[1]).find("part")
+    measures = piano.findall("measure")
+    assert [m.findtext("attributes/time/beats") for m in measures] == ["4", None, "3"]
+    # G4 is tied from the last beat of measure 1 into measure 2
+    assert measures[0].findall("note")[-1].find("tie").get("type") == "start"
+    assert measures[1].find("note").find("tie").get("type") == "stop"
+    # C5 starting 1ms before the barline is rounded to the downbeat of measure 2
+    assert [n.findtext("pitch/step") for n in measures[0].findall("note")] == [
+        "C",
+        "E",
+        "G",
+    ]
+    # it sounds as long as the tied G4, so the two are written as one chord
+    assert [
+        (n.findtext("pitch/step"), n.findtext("voice"), n.find("chord") is not None)
+        for n in measures[1].findall("note")
+    ] == [("G", "1", False), ("C", "1", True), ("D", "1", False)]
+    assert [e.tag for e in measures[1]].count("backup") == 0
+    # D4 is carried over the time signature change
+    assert measures[2].find("note").findtext("duration") == "36"
+
+
+def measure_elements(song, **options):
+    score = io.StringIO()
+    write_score(score, song, **options)
+    return (
+        ET.fromstring(score.getvalue().split("\n", 1)[1])
+        .find("part")
+        .findall("measure")
+    )
+
+
+def voice_lengths(measure):
+    """the divisions each voice of a measure fills, a chord's notes counted once"""
+    lengths = {}
+    for note in measure.findall("note"):
+        if note.find("chord") is not None:
+            continue
+        voice = note.findtext("voice")
+        lengths[voice] = lengths.get(voice, 0) + int(note.findtext("duration"))
+    return lengths
+
+
+@pytest.mark.parametrize(
+    "ticks, resolution, snap, divisions",
+    [
+        ([0, 10, 11, 220, 330], 220, 1, [0, 1, 1, 24, 36]),
+        ([0, 239, 240, 480], 480, 1, [0, 12, 12, 24]),
+        ([0, 35, 36, 96, 150], 96, 6, [0, 6, 12, 24, 36]),
+    ],
+)
+def test_ticks_to_divisions(ticks, resolution, snap, divisions):
+    # Act
+    result = ticks_to_divisions(ticks, resolution, snap)
+
+    # Assert
+    assert result.tolist() == divisions
+
+
+@pytest.mark.parametrize(
+    "notes, voices",
+    [
+        ([], []),
+        ([(0, 24), (24, 24), (48, 48)], [[(0, 24), (24, 24), (48, 48)]]),
+        # a triad under a melody needs four voices
+        (
+            [(0, 48), (0, 48), (0, 48), (0, 12), (12, 12), (24, 24)],
+            [[(0, 48)], [(0, 48)], [(0, 48)], [(0, 12), (12, 12), (24, 24)]],
+        ),
+        # the free voice that ended last is used, leaving no gap
+        (
+            [(0, 24), (0, 36), (36, 12), (48, 48)],
+            [[(0, 24)], [(0, 36), (36, 12), (48, 48)]],
+        ),
+    ],
+)
+def test_assign_voices(notes, voices):
+    # Act
+    result = assign_voices(notes)
+
+    # Assert
+    assert result == voices
+
+
+def test_write_score_tempo_changes_are_exact():
+    # Arrange: eighth notes on ticks, through tempo changes inside measures
+    song = pretty_midi.PrettyMIDI(resolution=96)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    song.key_signature_changes.append(pretty_midi.KeySignature(0, 0))
+    song._tick_scales = [(0, 0.5 / 96), (144, 0.37 / 96), (500, 0.81 / 96)]
+    song._update_tick_to_time(96 * 12)
+    piano = pretty_midi.Instrument(program=0, name="Piano")
+    for n in range(24):
+        piano.notes.append(
+            pretty_midi.Note(
+                100,
+                60 + n % 12,
+                song.tick_to_time(n * 48),
+                song.tick_to_time(n * 48 + 48),
+            )
+        )
+    song.instruments.append(piano)
+
+    # Act
+    measures = measure_elements(song)
+
+    # Assert
+    assert len(measures) == 3
+    assert [voice_lengths(measure) for measure in measures] == [{"1": 96}] * 3
+    assert {
+        note.findtext("duration") for m in measures for note in m.findall("note")
+    } == {"12"}
+
+
+def test_write_score_snap():
+    # Arrange
+    song = pretty_midi.PrettyMIDI(initial_tempo=120)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    song.key_signature_changes.append(pretty_midi.KeySignature(0, 0))
+    piano = pretty_midi.Instrument(program=0, name="Piano")
+    # a sixteenth note grid is 0.125 seconds at 120 bpm
+    for pitch, start, end in [(60, 0.02, 0.49), (62, 0.51, 0.53), (64, 0.61, 1.97)]:
+        piano.notes.append(pretty_midi.Note(100, pitch, start, end))
+    song.instruments.append(piano)
+
+    # Act
+    measures = measure_elements(song, snap=6)
+
+    # Assert
+    notes = measures[0].findall("note")
+    assert [note.findtext("duration") for note in notes] == ["24", "6", "48", "18"]
+    assert measures[0].find("forward") is None
+
+
+@pytest.mark.parametrize(
+    "start, snap",
+    [
+        # rounded to the barline the song ends on
+        (1.95, 6),
+        (1.999, 1),
+    ],
+)
+def test_write_score_note_starting_on_the_last_barline(start, snap):
+    # Arrange: a measure of 4/4 at 120 bpm, the last note starting at its end once quantized
+    song = pretty_midi.PrettyMIDI(initial_tempo=120)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    piano = pretty_midi.Instrument(program=0, name="Piano")
+    piano.notes.append(pretty_midi.Note(100, 60, 0.0, 1.9))
+    piano.notes.append(pretty_midi.Note(100, 62, start, 2.0))
+    song.instruments.append(piano)
+
+    # Act
+    measures = measure_elements(song, snap=snap)
+
+    # Assert: the note is written in a measure of its own, neither overfills
+    assert len(measures) == 2
+    for measure in measures:
+        forwards = sum(int(f.findtext("duration")) for f in measure.iter("forward"))
+        assert sum(voice_lengths(measure).values()) + forwards <= 96
+    assert [n.findtext("pitch/step") for n in measures[1].findall("note")] == ["D"]
+
+
+def test_write_score_time_signature_change_inside_measure():
+    # Arrange: 3/4 starts on the third beat of a 4/4 measure
+    song = pretty_midi.PrettyMIDI(initial_tempo=120)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    song.time_signature_changes.append(pretty_midi.TimeSignature(3, 4, 1.0))
+    song.key_signature_changes.append(pretty_midi.KeySignature(0, 0))
+    piano = pretty_midi.Instrument(program=0, name="Piano")
+    piano.notes.append(pretty_midi.Note(100, 60, 0.5, 1.75))
+    song.instruments.append(piano)
+
+    # Act
+    measures = measure_elements(song)
+
+    # Assert
+    assert [m.findtext("attributes/time/beats") for m in measures] == ["4", "3"]
+    assert [voice_lengths(m) for m in measures] == [{"1": 24}, {"1": 36}]
+    assert measures[0].find("forward/duration").text == "24"
+
+
+def test_write_score_attributes_on_changes():
+    # Arrange: 4/4 restated in measure 2, and a key change in measure 3
+    song = pretty_midi.PrettyMIDI(initial_tempo=120)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 2.0))
+    song.key_signature_changes.append(pretty_midi.KeySignature(0, 0))
+    song.key_signature_changes.append(pretty_midi.KeySignature(7, 4.0))
+    piano = pretty_midi.Instrument(program=0, name="Piano")
+    piano.notes.append(pretty_midi.Note(100, 60, 0.0, 8.0))
+    song.instruments.append(piano)
+
+    # Act
+    measures = measure_elements(song)
+
+    # Assert
+    assert [
+        [child.tag for child in m.find("attributes")]
+        for m in measures
+        if m.find("attributes") is not None
+    ] == [["divisions", "key", "time", "clef"], ["key"]]
+    assert [m.find("attributes") is not None for m in measures] == [
+        True,
+        False,
+        True,
+        False,
+    ]
+    assert measures[2].findtext("attributes/key/fifths") == "1"
+
+
+def test_write_score_chords():
+    # Arrange
+    song = pretty_midi.PrettyMIDI(initial_tempo=120)
+    song.time_signature_changes.append(pretty_midi.TimeSignature(4, 4, 0))
+    song.key_signature_changes.append(pretty_midi.KeySignature(0, 0))
+    piano = pretty_midi.Instrument(program=0, name="Piano")
+    # a half note triad under two quarter notes, then a dyad tied over the barline
+    for pitch, start, end in [
+        (67, 0.0, 1.0),
+        (60, 0.0, 1.0),
+        (64, 0.0, 1.0),
+        (72, 0.0, 0.5),
+        (74, 0.5, 1.0),
+        (60, 1.5, 2.5),
+        (64, 1.5, 2.5),
+    ]:
+        piano.notes.append(pretty_midi.Note(100, pitch, start, end))
+    song.instruments.append(piano)
+
+    # Act
+    measures = measure_elements(song)
+
+    # Assert
+    assert [
+        (
+            e.findtext("pitch/step") or e.tag,
+            e.findtext("voice"),
+            e.find("chord") is not None,
+        )
+        for e in measures[0]
+        if e.tag != "attributes"
+    ] == [
+        ("C", "1", False),
+        ("E", "1", True),
+        ("G", "1", True),
+        ("forward", None, False),
+        ("C", "1", False),
+        ("E", "1", True),
+        ("backup", None, False),
+        ("C", "2", False),
+        ("D", "2", False),
+    ]
+    assert [
+        (n.findtext("pitch/step"), n.find("tie").get("type"))
+        for n in measures[1].findall("note")
+    ] == [("C", "stop"), ("E", "stop")]
+    assert [voice_lengths(m) for m in measures] == [
+        {"1": 72, "2": 48},
+        {"1": 24},
+    ]
+
+
+def test_score_index_whole_song(carried_song):
+    # Arrange
+    expected = io.StringIO()
+    write_score(expected, carried_song)
+
+    # Act
+    index = ScoreIndex(carried_song)
+    result = index.render(1, len(index))
+
+    # Assert
+    assert len(index) == 3
+    assert result == expected.getvalue()
+    assert index.render(1, 99, as_bytes=True) == result.encode("utf-8")
+
+
+def test_score_index_window(carried_song):
+    # Arrange
+    whole = io.StringIO()
+    write_score(whole, carried_song)
+    wholeMeasures = (
+        ET.fromstring(whole.getvalue().split("\n", 1)[1])
+        .find("part")
+        .findall("measure")
+    )
+
+    # Act
+    window = ScoreIndex(carried_song).render(2, 3, parts=["P1"])
+
+    # Assert
+    score = ET.fromstring(window.split("\n", 1)[1])
+    assert [p.get("id") for p in score.iter("score-part")] == ["P1"]
+    measures = score.find("part").findall("measure")
+    assert [m.get("number") for m in measures] == ["2", "3"]
+    # the window starts with every attribute, restated
+    assert [child.tag for child in measures[0].find("attributes")] == [
+        "divisions",
+        "key",
+        "time",
+        "clef",
+    ]
+    assert measures[0].findtext("attributes/key/fifths") == "3"
+    # the G4 tied over from measure 1 keeps its tie stop
+    assert measures[0].find("note/tie").get("type") == "stop"
+    for measure, wholeMeasure in zip(measures, wholeMeasures[1:]):
+        assert [ET.tostring(e) for e in measure if e.tag != "attributes"] == [
+            ET.tostring(e) for e in wholeMeasure if e.tag != "attributes"
+        ]
+
+
+@pytest.mark.parametrize(
+    "first, last, parts", [(0, 2, None), (4, 5, None), (2, 1, None), (1, 2, ["P3"])]
+)
+def test_score_index_bad_window(carried_song, first, last, parts):
+    # Arrange
+    index = ScoreIndex(carried_song)
+
+    # Act / Assert
+    with pytest.raises(ValueError):
+        index.render(first, last, parts)
+
+
+def test_write_to_xml_mxl(tmp_path, carried_song):
+    # Arrange
+    path = str(tmp_path / "my song.mxl")
+    score = io.StringIO()
+    write_score(score, carried_song)
+
+    # Act
+    write_to_xml(carried_song, path, compresslevel=9)
+
+    # Assert
+    with zipfile.ZipFile(path) as archive:
+        mimetype, container, inner = archive.infolist()
+        assert mimetype.filename == "mimetype"
+        assert mimetype.compress_type == zipfile.ZIP_STORED
+        assert archive.read(mimetype) == b"application/vnd.recordare.musicxml"
+        rootfile = ET.fromstring(archive.read("META-INF/container.xml")).find(
+            "rootfiles/rootfile"
+        )
+        assert rootfile.get("full-path") == inner.filename == "my song.xml"
+        assert inner.compress_type == zipfile.ZIP_DEFLATED
+        assert archive.read(inner).decode("UTF8") == score.getvalue()
+
+
+def test_write_score_part_workers(carried_song):
+    # Arrange
+    strings = pretty_midi.Instrument(program=48, name="Strings")
+    for pitch, start in [(55, 0.0), (59, 1.0), (62, 2.5), (57, 4.0)]:
+        strings.notes.append(pretty_midi.Note(80, pitch, start, start + 1.25))
+    carried_song.instruments.append(strings)
+    serial = io.StringIO()
+    parallel = io.StringIO()
+
+    # Act
+    write_score(serial, carried_song, part_workers=1)
+    write_score(parallel, carried_song, part_workers=2)
+
+    # Assert
+    assert parallel.getvalue() == serial.getvalue()
+    assert serial.getvalue().count("<part id=") == 3
+
+
+def test_write_score_measure_cache(carried_song):
+    # Arrange
+    cache = MeasureCache()
+    write_score(io.StringIO(), carried_song, measure_cache=cache)
+    # moves the piano's F4 in the last measure up to G4
+    carried_song.instruments[0].notes[-1].pitch = 67
+    expected = io.StringIO()
+    write_score(expected, carried_song)
+    score = io.StringIO()
+
+    # Act
+    write_score(score, carried_song, measure_cache=cache)
+
+    # Assert
+    assert score.getvalue() == expected.getvalue()
+    assert (cache.rendered, cache.reused) == (1, 5)
+    assert len(cache.fragments) == 6
+
+
+@pytest.mark.parametrize("part_workers", [1, 2])
+def test_write_to_xml_stats(tmp_path, carried_song, part_workers):
+    # Arrange
+    # a half note tied to an eighth
+    carried_song.instruments[0].notes[0].end = 1.25
+    sink = io.StringIO()
+    stats = ConversionStats(json_sink(sink))
+    path = tmp_path / "song.xml"
+
+    # Act
+    result = write_to_xml(
+        carried_song, str(path), part_workers=part_workers, stats=stats
+    )
+
+    # Assert
+    assert result is stats
+    assert stats.counts == {
+        "parts": 2,
+        "notes": 9,
+        "measures": 6,
+        "note_elements": 12,
+        "rests": 0,
+        "backups": 1,
+        "forwards": 2,
+        "tie_splits": 1,
+        "output_bytes": path.stat().st_size,
+    }
+    assert set(stats.stages) == {
+        "remove_invalid_notes",
+        "downbeats",
+        "note_store",
+        "clef",
+        "quantize",
+        "emit",
+        "serialize",
+        "write",
+    }
+    assert all(wall >= 0 and cpu >= 0 for wall, cpu in stats.stages.values())
+    assert json.loads(sink.getvalue()) == stats.as_dict()